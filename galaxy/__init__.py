@@ -0,0 +1,20 @@
+"""
+Galaxy N-body simulation: common engine interface over the different versions of the project.
+
+Usage:
+    python -m galaxy run --engine bh-octree --integrator kdk --n 2500 --steps 1000
+"""
+from galaxy.registry import BACKENDS, INTEGRATORS, get_backend, get_integrator, register_backend, register_integrator
+from galaxy.simulation import Simulation
+from galaxy.loader import load_galaxy
+
+__all__ = [
+    "BACKENDS",
+    "INTEGRATORS",
+    "Simulation",
+    "get_backend",
+    "get_integrator",
+    "load_galaxy",
+    "register_backend",
+    "register_integrator",
+]
@@ -0,0 +1,3 @@
+from galaxy.cli import main
+
+main()
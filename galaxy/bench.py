@@ -0,0 +1,214 @@
+"""
+Benchmark harness reproducing the scaling tables of rapport.md.
+
+Every combination of engine x number of bodies x thread count x time step is timed
+in a fresh Simulation:
+- its construction is timed as the setup time: it imports the engine module, whose numba kernels
+  are compiled at import (explicit signatures) or loaded from the disk cache,
+- the first `warmup` steps are timed apart (lazily compiled kernels, first allocations, caches),
+- the following steps are timed one by one and summarized by their median and spread.
+
+Results are written as JSON (one record per configuration) and as Markdown tables
+in the layout of rapport.md (time for 10 steps and steps per second vs number of bodies,
+and time per step vs number of cores).
+"""
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+
+from galaxy.loader import galaxy_path, generated_galaxy_path
+from galaxy.simulation import Simulation
+
+
+def thread_counts(threads):
+    """
+    Thread counts that can actually be used: capped to the numba maximum (NUMBA_NUM_THREADS)
+    and without duplicates. [None] if numba is missing.
+    """
+    try:
+        import numba
+    except ImportError:
+        return [None]
+    return sorted({min(t, numba.config.NUMBA_NUM_THREADS) for t in threads})
+
+
+def set_threads(threads):
+    """
+    Set the number of numba threads used by the parallel kernels.
+    """
+    if threads is not None:
+        import numba
+        numba.set_num_threads(threads)
+
+
+def galaxy_file(n, directory, seed=0):
+    """
+    Galaxy data file for n stars: the one of data/ if it exists, otherwise a snapshot generated
+    once in directory with a fixed seed (so that all engines see the same initial conditions).
+    """
+    path = galaxy_path(n)
+    if os.path.exists(path):
+        return path
+    return generated_galaxy_path(n, seed, directory)
+
+
+def time_steps(simulation, n_steps, max_time=None):
+    """
+    Time n_steps steps one by one, stopping early (after at least one step) once max_time seconds are spent.
+    """
+    times = []
+    start_time = time.perf_counter()
+    for _ in range(n_steps):
+        t0 = time.perf_counter()
+        simulation.step()
+        times.append(time.perf_counter() - t0)
+        if max_time is not None and time.perf_counter() - start_time > max_time:
+            break
+    return np.array(times)
+
+
+def bench_one(filename, engine, integrator, dt, threads, steps, warmup, max_time=None, options=None):
+    """
+    Benchmark one configuration and return its record.
+    """
+    if steps < 1:
+        raise ValueError(f"at least one steady-state step must be timed, not {steps}")
+    set_threads(threads)
+
+    t0 = time.perf_counter()
+    simulation = Simulation.from_file(filename, engine=engine, integrator=integrator, dt=dt, **(options or {}))
+    setup_time = time.perf_counter() - t0
+
+    warmup_times = time_steps(simulation, warmup)
+    times = time_steps(simulation, steps, max_time)
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {
+        "engine": engine,
+        "integrator": integrator,
+        "n_bodies": len(simulation.masses),
+        "threads": threads,
+        "dt": dt,
+        "options": options or {},
+        "setup_time": setup_time,
+        "warmup_times": warmup_times.tolist(),
+        "step_times": times.tolist(),
+        "median": median,
+        "q1": q1,
+        "q3": q3,
+        "min": times.min(),
+        "max": times.max(),
+        "finite": bool(np.isfinite(simulation.positions).all()),
+    }
+
+
+def run_benchmarks(engines, sizes, threads=(1,), dts=(1e-3,), integrator="kdk", steps=10, warmup=2,
+                   max_time=None, options=None, data_dir=None, log=print):
+    """
+    Sweep engines x sizes x threads x dts and return the list of records.
+    Galaxy sizes missing from data/ are generated in data_dir (a temporary directory by default).
+    """
+    records = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = data_dir or tmp_dir
+        for n in sizes:
+            filename = galaxy_file(n, data_dir)
+            for engine in engines:
+                for n_threads in thread_counts(threads):
+                    for dt in dts:
+                        record = bench_one(filename, engine, integrator, dt, n_threads, steps, warmup,
+                                           max_time, options)
+                        record["n_stars"] = n
+                        records.append(record)
+                        if log is not None:
+                            log(f"{engine:12s} N={n:<8d} threads={record['threads']} dt={dt:g}: "
+                                f"median {record['median']:.4g} s/step "
+                                f"[{record['q1']:.4g}, {record['q3']:.4g}], setup {record['setup_time']:.4g} s, "
+                                f"warm-up {sum(record['warmup_times']):.4g} s")
+    return records
+
+
+def environment():
+    """
+    Description of the machine and library versions the benchmark ran on.
+    """
+    info = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+    try:
+        import numba
+        info["numba"] = numba.__version__
+        info["numba_max_threads"] = numba.config.NUMBA_NUM_THREADS
+    except ImportError:
+        pass
+    return info
+
+
+def write_json(filename, records):
+    with open(filename, "w") as file:
+        json.dump({"environment": environment(), "results": records}, file, indent=2)
+
+
+def markdown_tables(records):
+    """
+    Markdown tables in the layout of rapport.md, one section per engine, dt and thread count.
+    """
+    lines = []
+    groups = {}
+    for record in records:
+        groups.setdefault((record["engine"], record["integrator"], record["dt"]), []).append(record)
+
+    for (engine, integrator, dt), group in groups.items():
+        lines.append(f"### {engine} ({integrator}, dt={dt:g})")
+        lines.append("")
+        counts = sorted({r["threads"] or 0 for r in group})
+        sizes = sorted({r["n_stars"] for r in group})
+
+        for n_threads in counts:
+            by_size = {r["n_stars"]: r for r in group if (r["threads"] or 0) == n_threads}
+            if n_threads:
+                lines.append(f"{n_threads} thread(s) :")
+                lines.append("")
+            lines.append("| Nombre de corps | " + " | ".join(str(n) for n in sizes) + " |")
+            lines.append("| --- |" + " --- |" * len(sizes))
+            cells = [f"{10 * by_size[n]['median']:.4f} s" if n in by_size else "-" for n in sizes]
+            lines.append("| Temps pour 10 pas (médiane) | " + " | ".join(cells) + " |")
+            cells = [f"± {10 * (by_size[n]['q3'] - by_size[n]['q1']) / 2:.4f} s" if n in by_size else "-"
+                     for n in sizes]
+            lines.append("| Dispersion (demi-écart interquartile) | " + " | ".join(cells) + " |")
+            cells = [f"{1 / by_size[n]['median']:.2f}" if n in by_size else "-" for n in sizes]
+            lines.append("| Pas par seconde | " + " | ".join(cells) + " |")
+            cells = [f"{by_size[n]['setup_time']:.4f} s" if n in by_size else "-" for n in sizes]
+            lines.append("| Mise en place (compilation JIT ou cache compris) | " + " | ".join(cells) + " |")
+            cells = [f"{sum(by_size[n]['warmup_times']):.4f} s" if n in by_size else "-" for n in sizes]
+            lines.append("| Premiers pas (warm-up) | " + " | ".join(cells) + " |")
+            lines.append("")
+
+        if len(counts) > 1:
+            lines.append("Temps par pas en fonction du nombre de coeurs :")
+            lines.append("")
+            lines.append("| Nombre de corps \\ coeurs | " + " | ".join(str(t) for t in counts) + " |")
+            lines.append("| --- |" + " --- |" * len(counts))
+            for n in sizes:
+                by_threads = {r["threads"] or 0: r for r in group if r["n_stars"] == n}
+                cells = [f"{by_threads[t]['median']:.4f} s" if t in by_threads else "-" for t in counts]
+                lines.append(f"| {n} | " + " | ".join(cells) + " |")
+            lines.append("")
+
+    return "\n".join(lines)
+
+
+def write_markdown(filename, records):
+    info = environment()
+    header = (f"<!-- generated by python -m galaxy bench on {info['date']}, {info['platform']}, "
+              f"{info['cpu_count']} CPUs, numpy {info['numpy']}, numba {info.get('numba', '-')} -->\n\n")
+    with open(filename, "w") as file:
+        file.write(header + markdown_tables(records))
@@ -0,0 +1,163 @@
+"""
+Checkpoint/restart of a Simulation.
+
+A checkpoint is an uncompressed .npz file holding the positions, velocities and masses,
+the integrator state carried between steps (the kick-drift-kick acceleration and the block time
+step levels), the time, the step count, the seed of the initial conditions (from the snapshot header or
+--seed, -1 if unknown as for the text galaxy files) and the engine settings.
+Files are written to a temporary name, synced and renamed, so a checkpoint on disk is always
+complete even if the process is killed while writing.
+
+Restarting from a checkpoint gives bit-for-bit the same trajectory as an uninterrupted run,
+as long as the force backend is deterministic (true for all the built-in engines with the
+same number of numba threads: their parallel sums are always done in the same order).
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from galaxy_generator import generate_star_colors
+from galaxy.simulation import Simulation
+
+# Integrator attributes carried from one step to the next, saved when present
+INTEGRATOR_STATE = ("acceleration", "levels")
+
+
+def checkpoint_state(simulation):
+    """
+    Copy the state of a simulation into a dict of arrays (safe to write while the simulation goes on).
+    """
+    state = {
+        "positions": np.array(simulation.positions),
+        "velocities": np.array(simulation.velocities),
+        "masses": np.array(simulation.masses),
+        "time": np.float64(simulation.time),
+        "step_count": np.int64(simulation.step_count),
+        "dt": np.float64(simulation.dt),
+        "seed": np.int64(-1 if simulation.seed is None else simulation.seed),
+        "engine": np.str_(simulation.engine),
+        "integrator": np.str_(simulation.integrator_name),
+        "options": np.str_(json.dumps(simulation.options)),
+    }
+    for name in INTEGRATOR_STATE:
+        value = getattr(simulation.integrator, name, None)
+        if value is not None:
+            state["integrator_" + name] = np.array(value)
+    return state
+
+
+def write_checkpoint(filename, state):
+    """
+    Atomically write a state dict (see checkpoint_state) to filename.
+    """
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as file:
+        np.savez(file, **state)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def save_checkpoint(filename, simulation):
+    """
+    Write a checkpoint of simulation to filename, in the calling thread.
+    """
+    write_checkpoint(filename, checkpoint_state(simulation))
+
+
+def load_checkpoint(filename, **overrides):
+    """
+    Rebuild the Simulation saved in a checkpoint.
+    overrides replace the saved settings (e.g. engine="bh-octree" or dt=1e-4); engine options given
+    as keywords are merged into the saved ones.
+    """
+    with np.load(filename) as data:
+        state = {key: data[key] for key in data.files}
+
+    settings = {
+        "engine": str(state["engine"]),
+        "integrator": str(state["integrator"]),
+        "dt": float(state["dt"]),
+        "seed": None if int(state["seed"]) < 0 else int(state["seed"]),
+    }
+    options = json.loads(str(state["options"]))
+    for key, value in overrides.items():
+        if key in settings:
+            settings[key] = value
+        else:
+            options[key] = value
+
+    masses = state["masses"]
+    simulation = Simulation(state["positions"], state["velocities"], masses, generate_star_colors(masses),
+                            **settings, **options)
+    simulation.time = float(state["time"])
+    simulation.step_count = int(state["step_count"])
+    # The cached integrator state is only valid for the same integrator and force backend
+    saved = (str(state["integrator"]), str(state["engine"]), json.loads(str(state["options"])))
+    if (settings["integrator"], settings["engine"], options) == saved:
+        for name in INTEGRATOR_STATE:
+            if "integrator_" + name in state:
+                setattr(simulation.integrator, name, state["integrator_" + name])
+    return simulation
+
+
+class Checkpointer:
+    """
+    Periodic checkpoints written by a background thread.
+
+    The state is copied in the simulation thread (a memory copy), then written to disk by a
+    writer thread while the simulation goes on. At most one write is in flight: if the previous
+    checkpoint is still being written, the next one waits for it.
+    """
+
+    def __init__(self, filename, every):
+        """
+        filename is overwritten by each checkpoint, every is the number of steps between two checkpoints.
+        """
+        self.filename = filename
+        self.every = every
+        self.thread = None
+        self.error = None
+
+    def _write(self, state):
+        try:
+            write_checkpoint(self.filename, state)
+        except Exception as error:  # reported by the simulation thread at the next checkpoint
+            self.error = error
+
+    def wait(self):
+        """
+        Wait for the checkpoint being written, and raise its error if it failed.
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def save(self, simulation):
+        """
+        Start writing a checkpoint of simulation in the background.
+        """
+        state = checkpoint_state(simulation)
+        self.wait()
+        self.thread = threading.Thread(target=self._write, args=(state,), daemon=True)
+        self.thread.start()
+
+    def __call__(self, simulation):
+        """
+        Step callback: checkpoint every self.every steps.
+        """
+        if self.every > 0 and simulation.step_count % self.every == 0:
+            self.save(simulation)
+
+    def close(self, simulation=None):
+        """
+        Wait for the pending write and, if simulation is given, write a final checkpoint synchronously.
+        """
+        self.wait()
+        if simulation is not None:
+            save_checkpoint(self.filename, simulation)
@@ -0,0 +1,326 @@
+"""
+Command line entry point of the simulation.
+
+    python -m galaxy run --engine bh-octree --integrator kdk --n 2500 --steps 1000 --headless
+    python -m galaxy list
+    python -m galaxy convert data/galaxy_2500 data/galaxy_2500.snap
+    python -m galaxy run --n 2500 --steps 100000 --headless --checkpoint run.npz --checkpoint-every 1000
+    python -m galaxy bench --engines numba bh-octree --n 100 500 1000 2500 --threads 1 4 8 --json bench.json --markdown bench.md
+    python -m galaxy run --resume run.npz --steps 100000 --headless --checkpoint run.npz --checkpoint-every 1000
+    python -m galaxy warmup
+    python -m galaxy run --engine bh-octree --n 2500 --steps 0 --pipeline thread
+    python -m galaxy run --n 2500 --steps 10000 --headless --render frames/ --render-every 20
+    python -m galaxy run --n 2500 --steps 10000 --headless --record run.traj --record-every 10 --record-dtype float16
+    python -m galaxy replay run.traj
+
+The visualizer (SDL2 + OpenGL) is imported only when a window is requested, so headless runs
+work on machines without a display or without these modules installed.
+"""
+import argparse
+import signal
+import sys
+import time
+
+import numpy as np
+
+from galaxy import bench
+from galaxy.checkpoint import Checkpointer, load_checkpoint
+from galaxy.loader import galaxy_path, generated_galaxy_path
+from galaxy.pipeline import Pipeline
+from galaxy.registry import BACKENDS, INTEGRATORS
+from galaxy.simulation import Simulation
+from galaxy.snapshot import convert_text
+from galaxy.trajectory import Trajectory, TrajectoryRecorder, record_stars
+
+
+def parse_option(text):
+    """
+    Parse an engine option given as KEY=VALUE, VALUE being converted to int or float when possible.
+    """
+    if "=" not in text:
+        raise argparse.ArgumentTypeError(f"engine option '{text}' must be written KEY=VALUE")
+    key, value = text.split("=", 1)
+    for convert in (int, float):
+        try:
+            return key, convert(value)
+        except ValueError:
+            pass
+    return key, value
+
+
+def parse_size(text):
+    """
+    Parse an image size given as WIDTHxHEIGHT.
+    """
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"image size '{text}' must be written WIDTHxHEIGHT, e.g. 1024x768")
+    return width, height
+
+
+def positive_int(text):
+    """
+    Parse an integer that must be at least 1.
+    """
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m galaxy", description="N-body galaxy simulation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run a simulation")
+    run.add_argument("--engine", help="force backend (see 'list'), numba by default")
+    run.add_argument("--integrator", help="time integrator (see 'list'), kdk by default")
+    run.add_argument("--n", default=100, type=int, help="number of stars, loads data/galaxy_<n>")
+    run.add_argument("--file", help="galaxy data file, overrides --n")
+    run.add_argument("--seed", type=int, help="generate the <n> stars with this seed instead of loading data/galaxy_<n> "
+                                              "(kept as data/galaxy_<n>_seed<seed>.snap)")
+    run.add_argument("--steps", default=10, type=int, help="number of timed steps")
+    run.add_argument("--dt", type=float, help="time step in years, 1e-3 by default")
+    run.add_argument("--headless", action="store_true",
+                     help="only run the timed steps, never open a window nor import SDL2/OpenGL")
+    run.add_argument("-o", "--option", action="append", default=[], type=parse_option, metavar="KEY=VALUE",
+                     help="engine option, e.g. -o theta=0.7, or -o central=1 to apply the black hole as an "
+                          "external potential (can be repeated)")
+    run.add_argument("--checkpoint", metavar="FILE", help="write checkpoints to FILE (.npz)")
+    run.add_argument("--checkpoint-every", default=1000, type=int, metavar="K",
+                     help="steps between two checkpoints (a final one is always written)")
+    run.add_argument("--resume", metavar="FILE",
+                     help="restart from a checkpoint; its engine, integrator and dt are used unless given")
+    run.add_argument("--pipeline", choices=["thread", "process"],
+                     help="in the window, run the simulation in a worker thread or process and draw its latest frame")
+    run.add_argument("--render", metavar="OUTPUT",
+                     help="render frames offscreen: PNG files in the OUTPUT directory, or raw RGB24 frames "
+                          "appended to OUTPUT if it ends with .rgb or .raw")
+    run.add_argument("--render-every", default=10, type=positive_int, metavar="K", help="steps between two rendered frames")
+    run.add_argument("--render-size", default=(1024, 768), type=parse_size, metavar="WxH", help="frame size in pixels")
+    run.add_argument("--exposure", default=1.0, type=float, help="brightness of a single star in the rendered frames")
+    run.add_argument("--record", metavar="FILE", help="record the trajectory in a memory-mapped ring buffer FILE")
+    run.add_argument("--record-every", default=10, type=positive_int, metavar="K", help="steps between two recorded frames")
+    run.add_argument("--record-capacity", default=1000, type=positive_int, metavar="C",
+                     help="frames kept in the ring buffer (the oldest ones are overwritten)")
+    run.add_argument("--record-stars", type=int, metavar="M", help="record only M stars evenly spread over the galaxy")
+    run.add_argument("--record-dtype", default="float32", choices=["float16", "float32", "float64"],
+                     help="precision of the recorded positions")
+
+    benchmark = commands.add_parser("bench", help="time engines for several sizes, thread counts and time steps")
+    benchmark.add_argument("--engines", nargs="+", default=["numba"], help="force backends to compare")
+    benchmark.add_argument("--integrator", default="kdk", help="time integrator (see 'list')")
+    benchmark.add_argument("--n", nargs="+", type=int, default=[100, 500, 1000, 2500],
+                           help="numbers of stars (sizes missing from data/ are generated with a fixed seed)")
+    benchmark.add_argument("--threads", nargs="+", type=int, default=[1], help="numba thread counts")
+    benchmark.add_argument("--dt", nargs="+", type=float, default=[1e-3], help="time steps in years")
+    benchmark.add_argument("--steps", default=10, type=positive_int, help="steady-state steps timed per configuration")
+    benchmark.add_argument("--warmup", default=2, type=int, help="steps run first and timed apart (warm-up)")
+    benchmark.add_argument("--max-time", type=float, help="stop the steady-state steps after this many seconds")
+    benchmark.add_argument("-o", "--option", action="append", default=[], type=parse_option, metavar="KEY=VALUE",
+                           help="engine option passed to every engine")
+    benchmark.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    benchmark.add_argument("--markdown", metavar="FILE", help="write the rapport.md-style tables")
+
+    commands.add_parser("list", help="list the available engines and integrators")
+
+    convert = commands.add_parser("convert", help="convert a text galaxy file to a binary snapshot")
+    convert.add_argument("text_file", help="text file (mass px py pz vx vy vz per line)")
+    convert.add_argument("snapshot_file", help="binary snapshot to create")
+    convert.add_argument("--float32", action="store_true", help="store single precision values")
+
+    replay = commands.add_parser("replay", help="play a recorded trajectory in the window")
+    replay.add_argument("file", help="trajectory file written by run --record")
+    replay.add_argument("--stride", default=1, type=int, help="frames skipped between two displayed frames")
+
+    precompile = commands.add_parser("warmup", help="compile the numba kernels once and store them in the disk cache")
+    precompile.add_argument("modules", nargs="*", metavar="MODULE",
+                            help="engine modules to compile, all the numba ones by default")
+    return parser
+
+
+def open_window(simulation, pipeline_mode=None):
+    """
+    Display the simulation in a Visualizer3D window, one step per frame,
+    or with pipeline_mode the latest frame of a simulation running in a worker (see galaxy.pipeline).
+    """
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
+
+    luminosities = np.ones(len(simulation.masses), dtype=np.float32)
+    bounds = ((-3, 3), (-3, 3), (-3, 3))
+
+    visualizer = Visualizer3D(simulation.positions, simulation.colors, luminosities, bounds)
+    if pipeline_mode is None:
+        visualizer.run(updater=simulation.step, dt=simulation.dt)
+        return
+
+    with Pipeline(simulation, pipeline_mode) as pipeline:
+        visualizer.run(frames=pipeline.poll)
+    print(f"\n{pipeline.steps} steps in the {pipeline_mode} worker ({pipeline.steps_per_second():.2f} steps/s)")
+
+
+def build_simulation(args):
+    """
+    Create the simulation from a galaxy file, or restore it from a checkpoint with --resume.
+    """
+    settings = {key: value for key, value in (("engine", args.engine), ("integrator", args.integrator),
+                                              ("dt", args.dt)) if value is not None}
+    if args.resume:
+        return load_checkpoint(args.resume, **settings, **dict(args.option))
+
+    settings = {"engine": "numba", "integrator": "kdk", "dt": 1e-3, **settings}
+    if args.file:
+        filename = args.file
+    elif args.seed is not None:
+        filename = generated_galaxy_path(args.n, args.seed)
+    else:
+        filename = galaxy_path(args.n)
+    return Simulation.from_file(filename, **settings, **dict(args.option))
+
+
+def run(args):
+    simulation = build_simulation(args)
+
+    callbacks = []
+    checkpointer = None
+    stop_signal = None # signal received, acted upon after the current step
+    previous_handlers = {}
+    if args.checkpoint:
+        checkpointer = Checkpointer(args.checkpoint, args.checkpoint_every)
+        callbacks.append(checkpointer)
+
+        # SIGTERM (preemption) and Ctrl-C stop the run between two steps only, so that the final
+        # checkpoint holds the state of a completed step
+        def request_stop(signum, frame):
+            nonlocal stop_signal
+            stop_signal = signum
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous_handlers[signum] = signal.signal(signum, request_stop)
+
+    renderer = None
+    if args.render:
+        from galaxy.render import FrameRenderer # numba is only needed to render
+
+        width, height = args.render_size
+        renderer = FrameRenderer(args.render, simulation.colors, args.render_every, width, height,
+                                 exposure=args.exposure)
+        callbacks.append(renderer)
+
+    recorder = None
+    if args.record:
+        stars = record_stars(len(simulation.masses), args.record_stars)
+        recorder = TrajectoryRecorder(args.record, simulation, args.record_capacity, args.record_every, stars,
+                                      np.dtype(args.record_dtype))
+        callbacks.append(recorder)
+
+    def callback(simulation):
+        for function in callbacks:
+            function(simulation)
+        if stop_signal is not None:
+            sys.exit(128 + stop_signal)
+
+    start_time = time.perf_counter()
+    try:
+        simulation.run(args.steps, callback=callback if callbacks else None)
+        elapsed = time.perf_counter() - start_time
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        if checkpointer is not None:
+            checkpointer.close(simulation)
+        if renderer is not None:
+            renderer.close()
+        if recorder is not None:
+            recorder.close()
+    print(f"Time for {args.steps} steps ({len(simulation.masses)} bodies, engine={simulation.engine}, "
+          f"integrator={simulation.integrator_name}): {elapsed:.4f} seconds ({args.steps / elapsed:.2f} steps/s)\n")
+
+    if renderer is not None:
+        print(f"{renderer.frames} frames written to '{args.render}'")
+    if recorder is not None:
+        trajectory = recorder.trajectory
+        print(f"{len(trajectory)} frames of {len(trajectory.stars)} stars kept in '{args.record}'")
+
+    if not args.headless:
+        open_window(simulation, args.pipeline)
+
+
+def replay(args):
+    """
+    Display a recorded trajectory, one frame per window frame, looping at the end.
+    """
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
+
+    trajectory = Trajectory(args.file)
+    if len(trajectory) == 0:
+        raise SystemExit(f"'{args.file}' holds no frame")
+    print(f"{len(trajectory)} frames of {len(trajectory.stars)} stars, "
+          f"steps {trajectory.step(0)} to {trajectory.step(-1)} every {trajectory.every}")
+
+    frame = 0
+
+    def next_frame(dt):
+        nonlocal frame
+        frame = (frame + args.stride) % len(trajectory)
+        return trajectory[frame]
+
+    luminosities = np.ones(len(trajectory.stars), dtype=np.float32)
+    bounds = ((-3, 3), (-3, 3), (-3, 3))
+    visualizer = Visualizer3D(trajectory[0], trajectory.colors, luminosities, bounds)
+    visualizer.run(updater=next_frame)
+
+
+def run_bench(args):
+    records = bench.run_benchmarks(args.engines, args.n, args.threads, args.dt, args.integrator, args.steps,
+                                   args.warmup, args.max_time, dict(args.option))
+    if args.json:
+        bench.write_json(args.json, records)
+    if args.markdown:
+        bench.write_markdown(args.markdown, records)
+    else:
+        print()
+        print(bench.markdown_tables(records))
+
+
+def list_engines(args):
+    width = max(len(name) for name in [*BACKENDS, *INTEGRATORS])
+    print("Engines:")
+    for name, factory in sorted(BACKENDS.items()):
+        print(f"  {name:{width}s} {factory.__doc__.strip().splitlines()[0]}")
+    print("Integrators:")
+    for name, cls in sorted(INTEGRATORS.items()):
+        print(f"  {name:{width}s} {cls.__doc__.strip().splitlines()[0]}")
+
+
+def convert(args):
+    dtype = np.float32 if args.float32 else np.float64
+    start_time = time.perf_counter()
+    n = convert_text(args.text_file, args.snapshot_file, dtype)
+    print(f"Converted {n} bodies from '{args.text_file}' to '{args.snapshot_file}' "
+          f"({np.dtype(dtype).name}) in {time.perf_counter() - start_time:.4f} seconds")
+
+
+def warmup(args):
+    from galaxy.warmup import KERNEL_MODULES, warmup # numba is only needed by this command
+
+    start_time = time.perf_counter()
+    warmup(args.modules or KERNEL_MODULES)
+    print(f"Kernels ready in {time.perf_counter() - start_time:.3f} seconds")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "run":
+        run(args)
+    elif args.command == "bench":
+        run_bench(args)
+    elif args.command == "list":
+        list_engines(args)
+    elif args.command == "convert":
+        convert(args)
+    elif args.command == "replay":
+        replay(args)
+    elif args.command == "warmup":
+        warmup(args)
@@ -0,0 +1,171 @@
+"""
+Built-in force backends and integrators.
+
+Each engine module is imported only when its backend is instantiated, so that selecting
+one engine does not compile or import the others.
+"""
+import numpy as np
+
+import integrators
+from galaxy.registry import register_backend, register_integrator
+
+register_integrator("euler")(integrators.Euler)
+register_integrator("kdk")(integrators.VelocityVerlet)
+register_integrator("rk4")(integrators.RK4)
+register_integrator("block")(integrators.BlockTimeStep)
+
+
+@register_integrator("rk4-numba")
+def rk4_numba_integrator(positions, velocities, accel_func):
+    """
+    Classical Runge-Kutta of order 4 with preallocated stage positions and velocities and numba stage kernels (rk4.py).
+    """
+    import rk4
+    return rk4.BufferedRK4(positions, velocities, accel_func)
+
+
+def kernel_array(array):
+    """
+    Writable C-contiguous float64 copy of array: the numba kernels are compiled for this type only,
+    while snapshot masses may be read-only or float32.
+    """
+    return np.array(array, dtype=np.float64)
+
+
+@register_backend("body")
+def body_backend(mass):
+    """
+    Object-oriented version (galaxy_body.py): Body views on contiguous arrays.
+    """
+    import galaxy_body
+    system = galaxy_body.NBodies([galaxy_body.Body(m, np.zeros(3), np.zeros(3)) for m in mass])
+
+    def accel(positions):
+        system.positions[:] = positions
+        return system.accelerations()
+    return accel
+
+
+@register_backend("vectorized")
+def vectorized_backend(mass):
+    """
+    NumPy vectorized direct summation (galaxy_vectorized.py).
+    """
+    import galaxy_vectorized
+    return lambda positions: galaxy_vectorized.calculate_acceleration(positions, mass)
+
+
+@register_backend("vectorized-blocked")
+def vectorized_blocked_backend(mass, block_size=128):
+    """
+    NumPy direct summation by cache-sized tiles, O(N * block) memory (galaxy_vectorized.py).
+    """
+    import galaxy_vectorized
+    block_size = int(block_size)
+    return lambda positions: galaxy_vectorized.calculate_acceleration_blocked(positions, mass, block_size)
+
+
+@register_backend("vectorized-threads")
+def vectorized_threads_backend(mass, workers=0, block_size=128):
+    """
+    NumPy tiled direct summation with row blocks spread over a thread pool (galaxy_vectorized.py).
+    """
+    import galaxy_vectorized
+    return galaxy_vectorized.ThreadedAcceleration(mass, int(workers) or None, int(block_size))
+
+
+@register_backend("numba")
+def numba_backend(mass):
+    """
+    numba parallel direct summation (galaxy_numba.py).
+    """
+    import galaxy_numba
+    mass = kernel_array(mass)
+    accel = lambda positions: galaxy_numba.direct_acceleration(galaxy_numba.kernel_input(positions), mass)
+    accel.subset = lambda positions, active: galaxy_numba.subset_acceleration(
+        galaxy_numba.kernel_input(positions), mass, np.require(active, np.int64, ["C", "W"]))
+    return accel
+
+
+@register_backend("numba-sym")
+def numba_symmetric_backend(mass):
+    """
+    numba parallel direct summation visiting each pair once (Newton's third law, galaxy_numba.py).
+    """
+    import galaxy_numba
+    mass = kernel_array(mass)
+    return lambda positions: galaxy_numba.symmetric_acceleration(positions, mass)
+
+
+@register_backend("bh-dict")
+def bh_dict_backend(mass):
+    """
+    Barnes-Hut-like grid stored in a dictionary (verlet_barnes_hut_dict_version.py).
+    The grid cell size is fixed from the first positions, as in the script.
+    """
+    import verlet_barnes_hut_dict_version as bh_dict
+    grid_initialized = False
+
+    def accel(positions):
+        nonlocal grid_initialized
+        if not grid_initialized:
+            bh_dict.initialize_grid(positions) # sets the module globals square_size and radius
+            grid_initialized = True
+        return bh_dict.calculate_acceleration(positions, mass)
+    return accel
+
+
+@register_backend("bh-grid")
+def bh_grid_backend(mass):
+    """
+    Barnes-Hut-like 20x20 CSR grid compiled with numba (verlet_barnes_hut_morse_version.py).
+    """
+    import verlet_barnes_hut_morse_version as bh_grid
+    return bh_grid.grid_acceleration_func(mass)
+
+
+@register_backend("bh-octree")
+def bh_octree_backend(mass, theta=0.8, leaf_size=8):
+    """
+    Barnes-Hut octree compiled with numba (verlet_barnes_hut_octree_version.py).
+    """
+    import verlet_barnes_hut_octree_version as bh_octree
+    mass = kernel_array(mass)
+    leaf_size = int(leaf_size)
+    accel = lambda positions: bh_octree.calculate_acceleration(positions, mass, theta, leaf_size)
+    accel.subset = bh_octree.SubsetAcceleration(mass, theta, leaf_size)
+    return accel
+
+
+@register_backend("fmm")
+def fmm_backend(mass, order=4, theta=0.6, leaf_size=64):
+    """
+    Fast multipole method with Cartesian expansions on the octree, compiled with numba (galaxy_fmm.py).
+    """
+    import galaxy_fmm
+    mass = kernel_array(mass)
+    order = int(order)
+    leaf_size = int(leaf_size)
+    return lambda positions: galaxy_fmm.calculate_acceleration(positions, mass, order, theta, leaf_size)
+
+
+@register_backend("pm")
+def pm_backend(mass, n_mesh=64):
+    """
+    Particle-mesh solver: CIC mesh and isolated FFT Poisson solver, smoothed below a few cells (galaxy_pm.py).
+    """
+    import galaxy_pm
+    mass = kernel_array(mass)
+    n_mesh = galaxy_pm.mesh_size(n_mesh)
+    return lambda positions: galaxy_pm.calculate_acceleration(positions, mass, n_mesh)
+
+
+@register_backend("p3m")
+def p3m_backend(mass, n_mesh=64, split=1.25, cutoff=4.5):
+    """
+    Particle-mesh solver with the short-range force summed over neighbors (P3M, galaxy_pm.py).
+    """
+    import galaxy_pm
+    mass = kernel_array(mass)
+    n_mesh = galaxy_pm.mesh_size(n_mesh)
+    return lambda positions: galaxy_pm.calculate_acceleration(positions, mass, n_mesh, True, split, cutoff)
@@ -0,0 +1,87 @@
+"""
+Central black hole treated as an external potential instead of a body of the N-body sum.
+
+Every galaxy starts with a black hole thousands of times heavier than its stars. Summed as an
+ordinary body, it adds a row and a column to the pairwise kernels and sits at the root of every
+tree cell it belongs to. CentralMass removes it from the backend: the force backend only sees the
+stars, and the pull of the black hole on the stars and its recoil from them are two vectorized O(N)
+terms. The black hole stays in the position and velocity arrays (at its index) and is advanced by the
+integrator like the stars, so visualization, checkpoints and recordings are unchanged.
+"""
+import numpy as np
+
+G = 1.560339e-13  # Gravitational constant
+
+
+class CentralMass:
+    """
+    Acceleration function accel(positions) applying the most massive body as an external point mass.
+
+    Attributes:
+        index (int): index of the central mass in the bodies
+        central_mass (float): mass of the central body in solar masses
+        stars (slice or np.ndarray): indices of the other bodies
+    """
+
+    def __init__(self, factory, mass, **options):
+        """
+        factory(mass, **options) is the force backend, built for the stars only.
+        """
+        mass = np.asarray(mass, dtype=np.float64)
+        self.index = int(np.argmax(mass))
+        self.central_mass = float(mass[self.index])
+        self.stars = slice(1, None) if self.index == 0 else np.delete(np.arange(len(mass)), self.index)
+        self.star_masses = np.ascontiguousarray(mass[self.stars])
+        self.star_index = np.full(len(mass), -1, dtype=np.int64) # index of each body among the stars
+        self.star_index[self.stars] = np.arange(len(mass) - 1)
+        self.star_accel = factory(self.star_masses, **options)
+        if getattr(self.star_accel, "subset", None) is None:
+            self.subset = None # no restricted star forces: the block time steps fall back to full steps
+
+    def internal(self, positions):
+        """
+        Accelerations (N, 3) due to the stars on the stars, zero for the central mass.
+        """
+        accelerations = np.zeros_like(positions, dtype=np.float64)
+        accelerations[self.stars] = self.star_accel(np.ascontiguousarray(positions[self.stars], dtype=np.float64))
+        return accelerations
+
+    def external(self, positions):
+        """
+        Accelerations (N, 3) due to the central mass on the stars, and recoil of the central mass due to the stars.
+        """
+        accelerations = np.zeros_like(positions, dtype=np.float64)
+        diff = positions[self.index] - positions[self.stars] # from each star to the central mass
+        dist2 = np.einsum("ij,ij->i", diff, diff)
+        factor = np.zeros_like(dist2)
+        np.divide(G, dist2 * np.sqrt(dist2), out=factor, where=dist2 > 1e-20) # dist > 1e-10
+        factor = factor[:, np.newaxis] * diff
+        accelerations[self.stars] = self.central_mass * factor
+        accelerations[self.index] = -(self.star_masses[:, np.newaxis] * factor).sum(axis=0)
+        return accelerations
+
+    def subset(self, positions, active):
+        """
+        Accelerations (len(active), 3) of the bodies of indices active only, using the subset function of
+        the star backend (None if it has none). The recoil of the central mass is computed only if it is active.
+        """
+        accelerations = np.zeros((len(active), 3), dtype=np.float64)
+        is_star = active != self.index
+        stars = active[is_star]
+        if len(stars) > 0:
+            star_positions = np.ascontiguousarray(positions[self.stars], dtype=np.float64)
+            accelerations[is_star] = self.star_accel.subset(star_positions, self.star_index[stars])
+
+        diff = positions[self.index] - positions[stars]
+        dist2 = np.einsum("ij,ij->i", diff, diff)
+        factor = np.zeros_like(dist2)
+        np.divide(G * self.central_mass, dist2 * np.sqrt(dist2), out=factor, where=dist2 > 1e-20)
+        accelerations[is_star] += factor[:, np.newaxis] * diff
+        if not is_star.all():
+            accelerations[~is_star] = self.external(positions)[self.index]
+        return accelerations
+
+    def __call__(self, positions):
+        accelerations = self.internal(positions)
+        accelerations += self.external(positions)
+        return accelerations
@@ -0,0 +1,64 @@
+"""
+Loading of the initial conditions of a galaxy, from a text file or a binary snapshot.
+"""
+import os
+
+import numpy as np
+
+from galaxy_generator import generate_galaxy_chunked, generate_star_colors
+from galaxy.snapshot import is_snapshot, open_snapshot, read_header
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def galaxy_path(n):
+    """
+    Path of the galaxy data file shipped with the project for n stars:
+    data/galaxy_<n>.snap if it has been converted, data/galaxy_<n> otherwise.
+    """
+    path = os.path.join(DATA_DIR, f"galaxy_{n}")
+    if os.path.exists(path + ".snap"):
+        return path + ".snap"
+    return path
+
+
+def generated_galaxy_path(n, seed, directory=DATA_DIR):
+    """
+    Path of a snapshot of n stars generated with seed, created in directory the first time it is asked for.
+    """
+    path = os.path.join(directory, f"galaxy_{n}_seed{seed}.snap")
+    if not os.path.exists(path):
+        generate_galaxy_chunked(n, path, seed=seed, binary=True)
+    return path
+
+
+def load_text(filename):
+    """
+    Read a text file like (mass, positionx, positiony, positionz, velocityx, velocityy, velocityz)
+    Returns mass, positions and velocities arrays.
+    """
+    data = np.loadtxt(filename, ndmin=2)
+    return data[:, 0].copy(), data[:, 1:4].copy(), data[:, 4:7].copy()
+
+
+def galaxy_seed(filename):
+    """
+    Seed the galaxy of filename was generated with, read from the snapshot header.
+    None if unknown (text files, snapshots converted from text or generated without a seed).
+    """
+    if is_snapshot(filename):
+        return read_header(filename)[2]
+    return None
+
+
+def load_galaxy(filename):
+    """
+    Load a system of bodies from a text file like (mass, positionx, positiony, positionz, velocityx, velocityy, velocityz)
+    or from a binary snapshot (see galaxy.snapshot), which is memory-mapped read-only instead of being read.
+    Returns positions, velocities, masses and colors arrays.
+    """
+    if is_snapshot(filename):
+        mass, positions, velocities = open_snapshot(filename)
+    else:
+        mass, positions, velocities = load_text(filename)
+    return positions, velocities, mass, generate_star_colors(mass)
@@ -0,0 +1,211 @@
+"""
+Simulation and rendering decoupled as a producer/consumer pipeline.
+
+The simulation (producer) runs in a worker thread or in a separate process and publishes each
+completed step as a float32 frame of positions; the renderer (consumer) draws the latest published
+frame at its own rate. Neither side waits for the other: the physics runs as fast as it can while
+the window stays at the display rate.
+
+Frames go through a triple buffer: the producer writes the back frame, the consumer reads the
+front frame, and a completed frame is handed over by exchanging indices with the middle slot.
+Only these index exchanges are done under a lock (a few integer assignments, CPython has no atomic
+swap): frames are never copied nor read while it is held, so neither side blocks the other.
+
+In "thread" mode the numba kernels release the GIL (nogil=True) and the worker advances the given
+Simulation, which must not be used by another thread until the pipeline is stopped.
+In "process" mode the frames live in shared memory and the worker process rebuilds the simulation
+from its current state; the given Simulation is left untouched.
+"""
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from galaxy.simulation import Simulation
+
+# Slots of the shared state of a TripleBuffer
+BACK, MIDDLE, FRONT, FRESH, STEP = range(5)
+
+
+class TripleBuffer:
+    """
+    Three frames of positions exchanged between one producer and one consumer.
+
+    Attributes:
+        frames (np.ndarray): (3, N, 3) frames
+        state: shared integers (back, middle and front frame indices, new frame flag, step of the middle frame)
+        step (int): step of the front frame, -1 before the first published frame
+    """
+
+    def __init__(self, frames, state=None):
+        self.frames = frames
+        self.state = state if state is not None else multiprocessing.Array("q", [0, 1, 2, 0, -1])
+        self.step = -1
+
+    @property
+    def back(self):
+        """
+        Frame to be written by the producer (only the producer changes its index).
+        """
+        return self.frames[self.state[BACK]]
+
+    def publish(self, step):
+        """
+        Hand the back frame, written by the producer, over to the consumer.
+        """
+        state = self.state
+        with state.get_lock():
+            state[BACK], state[MIDDLE] = state[MIDDLE], state[BACK]
+            state[FRESH] = 1
+            state[STEP] = step
+
+    def latest(self):
+        """
+        Return the most recently published frame, or None if nothing was published since the last call.
+        The frame stays valid until the next call.
+        """
+        state = self.state
+        with state.get_lock():
+            if not state[FRESH]:
+                return None
+            state[FRONT], state[MIDDLE] = state[MIDDLE], state[FRONT]
+            state[FRESH] = 0
+            self.step = state[STEP]
+        return self.frames[state[FRONT]]
+
+
+def produce(simulation, buffer, stop, max_steps=None):
+    """
+    Advance the simulation and publish its positions after every step, until stop is set
+    or max_steps steps have been done.
+    """
+    while not stop.is_set() and (max_steps is None or simulation.step_count < max_steps):
+        positions = simulation.step()
+        buffer.back[:] = positions
+        buffer.publish(simulation.step_count)
+
+
+def produce_in_process(settings, start_time, step_count, shm_name, shape, state, stop, max_steps):
+    """
+    Entry point of the worker process: attach to the shared frames and run produce().
+    """
+    simulation = Simulation(**settings)
+    simulation.time = start_time
+    simulation.step_count = step_count
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buffer = TripleBuffer(np.ndarray(shape, dtype=np.float32, buffer=shm.buf), state)
+    try:
+        produce(simulation, buffer, stop, max_steps)
+    finally:
+        buffer.frames = None # release the view before closing the mapping
+        shm.close()
+
+
+class Pipeline:
+    """
+    A simulation stepping in a worker (thread or process) while the caller draws its latest positions.
+
+        with Pipeline(simulation, mode="thread") as pipeline:
+            visualizer.run(frames=pipeline.poll)
+
+    Attributes:
+        mode (str): "thread" or "process"
+        buffer (TripleBuffer): frames published by the worker
+    """
+
+    def __init__(self, simulation, mode="thread", max_steps=None):
+        """
+        max_steps, if given, is the step count at which the worker stops.
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError(f"unknown pipeline mode '{mode}', expected 'thread' or 'process'")
+        self.simulation = simulation
+        self.mode = mode
+        self.max_steps = max_steps
+        self.worker = None
+        self.error = None
+        self.shm = None
+        self.start_step = simulation.step_count
+        self.start_time = None
+
+        shape = (3, len(simulation.masses), 3)
+        if mode == "thread":
+            self.stop_event = threading.Event()
+            frames = np.empty(shape, dtype=np.float32)
+            state = multiprocessing.Array("q", [0, 1, 2, 0, -1])
+        else:
+            self.context = multiprocessing.get_context("spawn") # a fork would copy the numba thread pool
+            self.stop_event = self.context.Event()
+            self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+            frames = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf)
+            state = self.context.Array("q", [0, 1, 2, 0, -1])
+        frames[:] = simulation.positions # every slot starts with the current frame
+        self.buffer = TripleBuffer(frames, state)
+
+    def _produce(self):
+        try:
+            produce(self.simulation, self.buffer, self.stop_event, self.max_steps)
+        except BaseException as error:
+            self.error = error
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        if self.mode == "thread":
+            self.worker = threading.Thread(target=self._produce, daemon=True)
+        else:
+            simulation = self.simulation
+            settings = dict(positions=simulation.positions, velocities=simulation.velocities,
+                            masses=np.asarray(simulation.masses), engine=simulation.engine,
+                            integrator=simulation.integrator_name, dt=simulation.dt, seed=simulation.seed,
+                            **simulation.options)
+            self.worker = self.context.Process(
+                target=produce_in_process, daemon=True,
+                args=(settings, simulation.time, simulation.step_count, self.shm.name, self.buffer.frames.shape,
+                      self.buffer.state, self.stop_event, self.max_steps))
+        self.worker.start()
+        return self
+
+    def poll(self):
+        """
+        Latest published positions, or None if the worker has not completed a step since the last call.
+        """
+        return self.buffer.latest()
+
+    @property
+    def steps(self):
+        """
+        Number of steps published by the worker since the start.
+        """
+        return max(self.buffer.state[STEP] - self.start_step, 0)
+
+    def steps_per_second(self):
+        elapsed = time.perf_counter() - self.start_time
+        return self.steps / elapsed if elapsed > 0 else 0.0
+
+    def stop(self):
+        """
+        Stop the worker after its current step and wait for it.
+        Errors raised in the worker are raised again here.
+        """
+        self.stop_event.set()
+        if self.worker is not None:
+            self.worker.join()
+            if self.mode == "process" and self.worker.exitcode != 0:
+                self.error = RuntimeError(f"simulation process exited with code {self.worker.exitcode}")
+            self.worker = None
+        if self.shm is not None:
+            self.buffer.frames = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,51 @@
+"""
+Registries of the force backends and integrators available to a Simulation.
+
+A force backend is registered as a factory: factory(mass, **options) returns a function
+accel(positions) computing the (N, 3) array of accelerations. The function may also have a
+subset(positions, active) attribute computing the (len(active), 3) accelerations of the bodies of
+indices active only, used by the block time step integrator (otherwise it takes full kick-drift-kick steps).
+An integrator is a class (or a factory function) built as Integrator(positions, velocities, accel_func),
+returning an object exposing positions, velocities and step(dt).
+"""
+
+BACKENDS = {}
+INTEGRATORS = {}
+
+
+def register_backend(name):
+    """
+    Decorator registering a force backend factory under name.
+    """
+    def decorator(factory):
+        BACKENDS[name] = factory
+        return factory
+    return decorator
+
+
+def register_integrator(name):
+    """
+    Decorator registering an integrator class under name.
+    """
+    def decorator(cls):
+        INTEGRATORS[name] = cls
+        return cls
+    return decorator
+
+
+def get_backend(name):
+    """
+    Return the force backend factory registered under name.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown engine '{name}', available engines: {', '.join(sorted(BACKENDS))}")
+    return BACKENDS[name]
+
+
+def get_integrator(name):
+    """
+    Return the integrator class registered under name.
+    """
+    if name not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator '{name}', available integrators: {', '.join(sorted(INTEGRATORS))}")
+    return INTEGRATORS[name]
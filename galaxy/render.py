@@ -0,0 +1,190 @@
+"""
+Offscreen rendering of a simulation to image or video frames, without a display.
+
+Points are projected with the same camera as Visualizer3D (45 degrees perspective looking at the
+center of the bounds) and splatted into a float framebuffer with additive blending, as the
+window does with glBlendFunc(GL_SRC_ALPHA, GL_ONE). The framebuffer is then clipped to 8 bits and
+written either as a PNG sequence (encoded with zlib, no imaging library needed) or appended to a
+raw RGB24 video stream, readable for instance with
+
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s 1024x768 -r 30 -i frames.rgb galaxy.mp4
+
+Rendering and encoding are done by a background thread: the simulation thread only copies the
+positions of the steps to render.
+"""
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numba
+import numpy as np
+
+RAW_EXTENSIONS = (".rgb", ".raw")
+
+
+def view_matrix(center, distance=5.0, rotation_x=0.0, rotation_y=0.0):
+    """
+    4x4 model-view matrix of the Visualizer3D camera: translate(0, 0, -distance) rotate_x rotate_y translate(-center).
+    Angles are in degrees.
+    """
+    ax, ay = np.radians(rotation_x), np.radians(rotation_y)
+    rx = np.array([[1, 0, 0, 0],
+                   [0, np.cos(ax), -np.sin(ax), 0],
+                   [0, np.sin(ax), np.cos(ax), 0],
+                   [0, 0, 0, 1]])
+    ry = np.array([[np.cos(ay), 0, np.sin(ay), 0],
+                   [0, 1, 0, 0],
+                   [-np.sin(ay), 0, np.cos(ay), 0],
+                   [0, 0, 0, 1]])
+    back = np.eye(4)
+    back[2, 3] = -distance
+    shift = np.eye(4)
+    shift[:3, 3] = -np.asarray(center, dtype=np.float64)
+    return np.ascontiguousarray(back @ rx @ ry @ shift)
+
+
+@numba.njit("(f4[:, ::1], f4[:, ::1], f8[:, ::1], f8, f8, f8, f4[:, :, ::1])", cache=True, nogil=True)
+def splat(points, colors, matrix, focal, near, far, framebuffer):
+    """
+    Project the points with the model-view matrix and a perspective of focal length focal
+    (1 / tan(fovy / 2)), and add the color of each point to the pixel it falls on.
+    Points outside of the [near, far] depth range or of the image are skipped.
+    """
+    height, width = framebuffer.shape[0], framebuffer.shape[1]
+    aspect = width / height
+    for i in range(points.shape[0]):
+        x, y, z = points[i, 0], points[i, 1], points[i, 2]
+        ex = matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2] * z + matrix[0, 3]
+        ey = matrix[1, 0] * x + matrix[1, 1] * y + matrix[1, 2] * z + matrix[1, 3]
+        depth = -(matrix[2, 0] * x + matrix[2, 1] * y + matrix[2, 2] * z + matrix[2, 3])
+        if depth < near or depth > far:
+            continue
+        px = int((focal / aspect * ex / depth + 1.0) * 0.5 * width)
+        py = int((1.0 - focal * ey / depth) * 0.5 * height)
+        if 0 <= px < width and 0 <= py < height:
+            framebuffer[py, px, 0] += colors[i, 0]
+            framebuffer[py, px, 1] += colors[i, 1]
+            framebuffer[py, px, 2] += colors[i, 2]
+
+
+def encode_png(image):
+    """
+    Encode an (H, W, 3) uint8 RGB image as PNG bytes.
+    """
+    height, width = image.shape[:2]
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    # Each row starts with its filter type (0: none)
+    rows = np.zeros((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, 3 * width)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0) # 8 bits RGB
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) + chunk(b"IEND", b""))
+
+
+class FrameRenderer:
+    """
+    Render a simulation every `every` steps to a PNG sequence or a raw RGB24 video stream.
+
+    output is a directory (created if needed) receiving frame_<step>.png files, or a file ending
+    with .rgb or .raw to which raw frames are appended.
+    Used as a step callback like Checkpointer: renderer(simulation), then renderer.close().
+    """
+
+    def __init__(self, output, colors=None, every=10, width=1024, height=768, bounds=((-3, 3), (-3, 3), (-3, 3)),
+                 exposure=1.0, rotation_x=0.0, rotation_y=0.0, zoom=1.0, queue_size=4):
+        """
+        colors (N, 3) are RGB values between 0 and 255 (white if None), scaled by exposure.
+        At most queue_size frames wait for the writer thread, after which the simulation waits for it.
+        """
+        self.output = output
+        self.raw = output.endswith(RAW_EXTENSIONS)
+        self.every = every
+        self.width = width
+        self.height = height
+        self.colors = None if colors is None else np.ascontiguousarray(np.asarray(colors) * (exposure / 255.0),
+                                                                      dtype=np.float32)
+        self.exposure = exposure
+        center = [(low + high) / 2.0 for low, high in bounds]
+        self.matrix = view_matrix(center, 5.0 / zoom, rotation_x, rotation_y)
+        self.focal = 1.0 / np.tan(np.radians(45.0) / 2)
+        self.frames = 0
+        self.error = None
+
+        # Open the output here, so that an invalid path is reported to the caller and not lost in the writer thread
+        if self.raw:
+            self.stream = open(output, "ab")
+        else:
+            self.stream = None
+            os.makedirs(output, exist_ok=True)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._write_frames, daemon=True)
+        self.thread.start()
+
+    def render(self, positions):
+        """
+        Render positions to an (H, W, 3) uint8 image.
+        """
+        points = np.ascontiguousarray(positions, dtype=np.float32)
+        colors = self.colors
+        if colors is None:
+            colors = np.full((len(points), 3), self.exposure, dtype=np.float32)
+        framebuffer = np.zeros((self.height, self.width, 3), dtype=np.float32)
+        splat(points, colors, self.matrix, self.focal, 0.1, 100.0, framebuffer)
+        np.clip(framebuffer, 0.0, 1.0, out=framebuffer)
+        return (framebuffer * 255.0 + 0.5).astype(np.uint8)
+
+    def _write_frames(self):
+        stream = self.stream
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                step, positions = item
+                if self.error is not None:
+                    continue # keep draining the queue so that the simulation never blocks
+                try:
+                    image = self.render(positions)
+                    if self.raw:
+                        stream.write(image.tobytes())
+                    else:
+                        with open(os.path.join(self.output, f"frame_{step:08d}.png"), "wb") as file:
+                            file.write(encode_png(image))
+                    self.frames += 1
+                except Exception as error:  # reported by the simulation thread at the next frame
+                    self.error = error
+        finally:
+            if stream is not None:
+                stream.close()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, positions, step):
+        """
+        Queue a frame: positions are copied as float32, then rendered and written in the background.
+        """
+        self._raise_error()
+        self.queue.put((step, np.array(positions, dtype=np.float32)))
+
+    def __call__(self, simulation):
+        """
+        Step callback: render every self.every steps.
+        """
+        if self.every > 0 and simulation.step_count % self.every == 0:
+            self.submit(simulation.positions, simulation.step_count)
+
+    def close(self):
+        """
+        Write the queued frames and stop the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self._raise_error()
@@ -0,0 +1,83 @@
+"""
+Common simulation interface: a set of bodies advanced by an integrator driven by a force backend.
+"""
+from galaxy import engines  # noqa: F401  (registers the built-in backends and integrators)
+from galaxy.external import CentralMass
+from galaxy.loader import galaxy_seed, load_galaxy
+from galaxy.registry import get_backend, get_integrator
+
+
+class Simulation:
+    """
+    A galaxy simulated with a given force backend (engine) and integrator.
+
+    Attributes:
+        masses (np.ndarray): (N,) masses in solar masses
+        colors (np.ndarray): (N, 3) RGB colors
+        integrator: integrator object holding positions and velocities
+        dt (float): default time step in years
+        time (float): simulated time in years
+        step_count (int): number of steps performed
+        seed (int or None): seed of the generated initial conditions, kept in checkpoints
+    """
+
+    def __init__(self, positions, velocities, masses, colors=None, engine="numba", integrator="kdk",
+                 dt=1e-3, seed=None, **options):
+        """
+        options are passed to the force backend factory (e.g. theta for bh-octree), except central:
+        with central=1 the most massive body (the black hole) is taken out of the backend and applied
+        as an external point mass (see galaxy/external.py).
+        """
+        self.masses = masses
+        self.colors = colors
+        self.engine = engine
+        self.integrator_name = integrator
+        self.options = options
+        backend_options = dict(options)
+        if backend_options.pop("central", False):
+            self.accel_func = CentralMass(get_backend(engine), masses, **backend_options)
+        else:
+            self.accel_func = get_backend(engine)(masses, **backend_options)
+        self.integrator = get_integrator(integrator)(positions, velocities, self.accel_func)
+        self.dt = dt
+        self.time = 0.0
+        self.step_count = 0
+        self.seed = seed
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        """
+        Build a simulation from a galaxy data file, with the seed stored in its header if it is a snapshot.
+        """
+        positions, velocities, masses, colors = load_galaxy(filename)
+        kwargs.setdefault("seed", galaxy_seed(filename))
+        return cls(positions, velocities, masses, colors, **kwargs)
+
+    @property
+    def positions(self):
+        return self.integrator.positions
+
+    @property
+    def velocities(self):
+        return self.integrator.velocities
+
+    def step(self, dt=None):
+        """
+        Advance the simulation by one time step (self.dt by default) and return the positions.
+        """
+        dt = self.dt if dt is None else dt
+        positions = self.integrator.step(dt)
+        self.time += dt
+        self.step_count += 1
+        return positions
+
+    def run(self, n_steps, callback=None):
+        """
+        Perform n_steps steps and return the positions.
+        callback(simulation), if given, is called after each step (checkpoints, recording...).
+        """
+        for _ in range(n_steps):
+            self.step()
+            if callback is not None:
+                callback(self)
+        return self.positions
@@ -0,0 +1,132 @@
+"""
+Binary snapshot format of a galaxy.
+
+A snapshot is a 64 bytes header followed by three contiguous little-endian columns:
+
+    header      magic b"GALAXYSN", format version, float size (4 or 8 bytes), number of bodies N,
+                seed of the generator (-1 if unknown, always unknown in version 1 files)
+    mass        (N,)    solar masses
+    positions   (N, 3)  light-years
+    velocities  (N, 3)  light-years per year
+
+The columns are opened with np.memmap, so loading a snapshot does not read nor copy the data:
+pages are read from disk when the arrays are first accessed.
+"""
+import numpy as np
+
+MAGIC = b"GALAXYSN"
+VERSION = 2
+READABLE_VERSIONS = (1, 2) # version 1 has no seed (zeros in its reserved bytes)
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("itemsize", "<u4"),
+    ("n", "<u8"),
+    ("seed", "<i8"),
+    ("reserved", "V32"),
+])
+
+
+def body_dtype(n, dtype=np.float64):
+    """
+    Structured dtype describing the columns of a snapshot of n bodies.
+    """
+    float_type = np.dtype(dtype).newbyteorder("<")
+    if float_type.kind != "f" or float_type.itemsize not in (4, 8):
+        raise ValueError(f"snapshots store float32 or float64 values, not {np.dtype(dtype)}")
+    return np.dtype([
+        ("mass", float_type, (n,)),
+        ("positions", float_type, (n, 3)),
+        ("velocities", float_type, (n, 3)),
+    ])
+
+
+def is_snapshot(filename):
+    """
+    True if filename starts with the snapshot magic number.
+    """
+    with open(filename, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_header(filename):
+    """
+    Return (n, dtype, seed) read from the header of a snapshot, seed being None if unknown.
+    """
+    header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header["magic"][0] != MAGIC:
+        raise ValueError(f"'{filename}' is not a galaxy snapshot")
+    if header["version"][0] not in READABLE_VERSIONS:
+        raise ValueError(f"'{filename}' has snapshot version {header['version'][0]}, expected {VERSION}")
+    dtype = np.float32 if header["itemsize"][0] == 4 else np.float64
+    seed = int(header["seed"][0]) if header["version"][0] >= 2 else -1
+    return int(header["n"][0]), dtype, None if seed < 0 else seed
+
+
+def create_snapshot(filename, n, dtype=np.float64, seed=None):
+    """
+    Create a snapshot file for n bodies and return writable memory-mapped (mass, positions, velocities).
+    seed is the seed of the generator of the bodies, if they were generated with one.
+    The arrays are written to disk when they are flushed (mass.flush() flushes the whole file) or released.
+    """
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["itemsize"] = np.dtype(dtype).itemsize
+    header["n"] = n
+    header["seed"] = -1 if seed is None else seed
+    columns = body_dtype(n, dtype)
+    with open(filename, "wb") as file:
+        file.write(header.tobytes())
+        file.truncate(HEADER_SIZE + columns.itemsize)
+
+    snapshot = np.memmap(filename, dtype=columns, mode="r+", offset=HEADER_SIZE, shape=(1,))
+    # memmap views (not plain arrays) so that the caller can flush() them
+    return snapshot["mass"][0], snapshot["positions"][0], snapshot["velocities"][0]
+
+
+def open_snapshot(filename, mode="r"):
+    """
+    Memory-map a snapshot and return (mass, positions, velocities) without reading the data.
+    mode is the np.memmap mode: "r" (read-only), "r+" (write through) or "c" (copy-on-write).
+    """
+    n, dtype, _ = read_header(filename)
+    snapshot = np.memmap(filename, dtype=body_dtype(n, dtype), mode=mode, offset=HEADER_SIZE, shape=(1,))
+    record = snapshot[0]
+    # Plain ndarray views on the mapping (no copy), usable by numpy and numba like any other array
+    return np.asarray(record["mass"]), np.asarray(record["positions"]), np.asarray(record["velocities"])
+
+
+def write_snapshot(filename, mass, positions, velocities, dtype=np.float64):
+    """
+    Write the given bodies to a snapshot file.
+    """
+    out_mass, out_positions, out_velocities = create_snapshot(filename, len(mass), dtype)
+    out_mass[:] = mass
+    out_positions[:] = positions
+    out_velocities[:] = velocities
+    out_mass.flush()
+
+
+def convert_text(text_file, snapshot_file, dtype=np.float64, chunk_size=1_000_000):
+    """
+    Convert a text galaxy file (mass px py pz vx vy vz per line) to a snapshot.
+    The text file is read by chunks of chunk_size lines, so memory use does not depend on its size.
+    Returns the number of bodies.
+    """
+    with open(text_file, "rb") as file:
+        n = sum(1 for line in file if line.strip())
+
+    mass, positions, velocities = create_snapshot(snapshot_file, n, dtype)
+    start = 0
+    with open(text_file, "r") as file:
+        while start < n:
+            data = np.loadtxt(file, max_rows=chunk_size, ndmin=2)
+            end = start + len(data)
+            mass[start:end] = data[:, 0]
+            positions[start:end] = data[:, 1:4]
+            velocities[start:end] = data[:, 4:7]
+            start = end
+    mass.flush()
+    return n
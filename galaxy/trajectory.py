@@ -0,0 +1,247 @@
+"""
+Trajectory recording in a memory-mapped ring buffer.
+
+A trajectory file keeps the last `capacity` recorded frames of a simulation (every k steps,
+optionally for a subset of the stars and in reduced precision). It is a 64 bytes header
+followed by contiguous little-endian columns, preallocated when the file is created:
+
+    header   magic b"GALAXYTR", format version, float size (2, 4 or 8 bytes), capacity C,
+             number of recorded stars N, number of frames recorded so far, steps between frames
+    steps    (C,)       step number of the frame held by each slot
+    times    (C,)       simulated time of the frame held by each slot, in years
+    stars    (N,)       indices of the recorded stars in the simulation
+    frames   (C, N, 3)  positions in light-years
+    colors   (N, 3)     RGB colors (0-255) of the recorded stars
+
+Frame k (k-th frame recorded since the start) is stored in slot k % C, so any frame still in the
+buffer is found in O(1), by its number or by its step. The header count is updated after the frame
+and its index entry are written, so a reader never sees a partially written frame as recorded.
+"""
+import queue
+import threading
+
+import numpy as np
+
+MAGIC = b"GALAXYTR"
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("itemsize", "<u4"),
+    ("capacity", "<u8"),
+    ("n", "<u8"),
+    ("count", "<u8"),
+    ("every", "<u8"),
+    ("reserved", "V16"),
+])
+
+
+def trajectory_dtype(capacity, n, dtype=np.float32):
+    """
+    Structured dtype describing the columns of a trajectory file.
+    """
+    float_type = np.dtype(dtype).newbyteorder("<")
+    if float_type.kind != "f":
+        raise ValueError(f"trajectories store float16, float32 or float64 positions, not {np.dtype(dtype)}")
+    return np.dtype([
+        ("steps", "<i8", (capacity,)),
+        ("times", "<f8", (capacity,)),
+        ("stars", "<i8", (n,)),
+        ("frames", float_type, (capacity, n, 3)),
+        ("colors", "u1", (n, 3)),
+    ])
+
+
+class Trajectory:
+    """
+    Memory-mapped trajectory file (see the module documentation).
+
+    Frames are numbered from the oldest one still in the buffer (0) to the newest (len - 1).
+
+    Attributes:
+        capacity (int): number of slots of the ring buffer
+        every (int): steps between two recorded frames
+        stars (np.ndarray): (N,) indices of the recorded stars in the simulation
+        colors (np.ndarray): (N, 3) RGB colors of the recorded stars
+    """
+
+    def __init__(self, filename, mode="r"):
+        """
+        Open an existing trajectory file, mode being the np.memmap mode ("r" or "r+").
+        """
+        self.filename = filename
+        self.header = np.memmap(filename, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+        if self.header["magic"][0] != MAGIC:
+            raise ValueError(f"'{filename}' is not a galaxy trajectory")
+        if self.header["version"][0] != VERSION:
+            raise ValueError(f"'{filename}' has trajectory version {self.header['version'][0]}, expected {VERSION}")
+        self.capacity = int(self.header["capacity"][0])
+        self.every = int(self.header["every"][0])
+        dtype = {2: np.float16, 4: np.float32, 8: np.float64}[int(self.header["itemsize"][0])]
+        n = int(self.header["n"][0])
+        self.columns = np.memmap(filename, dtype=trajectory_dtype(self.capacity, n, dtype), mode=mode,
+                                 offset=HEADER_SIZE, shape=(1,))
+        record = self.columns[0]
+        self.steps = record["steps"]
+        self.times = record["times"]
+        self.stars = record["stars"]
+        self.frames = record["frames"]
+        self.colors = record["colors"]
+
+    @classmethod
+    def create(cls, filename, capacity, stars, colors=None, every=1, dtype=np.float32):
+        """
+        Create a trajectory file for `capacity` frames of the given stars and open it for writing.
+        """
+        if capacity < 1 or every < 1:
+            raise ValueError(f"a trajectory needs capacity >= 1 and every >= 1, not capacity={capacity}, every={every}")
+        stars = np.asarray(stars, dtype=np.int64)
+        columns = trajectory_dtype(capacity, len(stars), dtype)
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["itemsize"] = np.dtype(dtype).itemsize
+        header["capacity"] = capacity
+        header["n"] = len(stars)
+        header["every"] = every
+        with open(filename, "wb") as file:
+            file.write(header.tobytes())
+            file.truncate(HEADER_SIZE + columns.itemsize)
+
+        trajectory = cls(filename, mode="r+")
+        trajectory.stars[:] = stars
+        trajectory.colors[:] = 255 if colors is None else np.asarray(colors)[stars]
+        return trajectory
+
+    @property
+    def count(self):
+        """
+        Number of frames recorded since the creation of the file (older ones may have been overwritten).
+        """
+        return int(self.header["count"][0])
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def slot(self, k):
+        """
+        Slot holding frame k (negative k counts from the newest frame).
+        """
+        size = len(self)
+        if k < 0:
+            k += size
+        if not 0 <= k < size:
+            raise IndexError(f"frame {k} is not in the trajectory ({size} frames)")
+        return (self.count - size + k) % self.capacity
+
+    def __getitem__(self, k):
+        """
+        Positions (N, 3) of frame k, a view on the file.
+        """
+        return self.frames[self.slot(k)]
+
+    def step(self, k):
+        return int(self.steps[self.slot(k)])
+
+    def time(self, k):
+        return float(self.times[self.slot(k)])
+
+    def find_step(self, step):
+        """
+        Number of the frame recorded at the given step, or None if it is not (or no longer) in the buffer.
+        Frames are recorded every `every` steps, so the frame number follows from the step of the oldest one.
+        """
+        if len(self) == 0:
+            return None
+        k, remainder = divmod(step - self.step(0), self.every)
+        if remainder != 0 or not 0 <= k < len(self) or self.step(k) != step:
+            return None
+        return k
+
+    def append(self, positions, step, time):
+        """
+        Write a frame in the next slot (overwriting the oldest one when the buffer is full).
+        """
+        count = self.count
+        slot = count % self.capacity
+        self.frames[slot] = positions
+        self.steps[slot] = step
+        self.times[slot] = time
+        self.header["count"] = count + 1
+
+    def flush(self):
+        self.columns.flush()
+        self.header.flush()
+
+
+def record_stars(n, n_recorded=None):
+    """
+    Indices of n_recorded stars evenly spread over the n stars of a simulation (all of them by default).
+    """
+    if n_recorded is None or n_recorded >= n:
+        return np.arange(n)
+    return np.linspace(0, n - 1, n_recorded).astype(np.int64)
+
+
+class TrajectoryRecorder:
+    """
+    Record a simulation every `every` steps into a trajectory file, from a background thread.
+
+    The simulation thread only copies the positions of the recorded stars; the writer thread casts
+    them to the file precision and writes them into the memory-mapped ring buffer.
+    Used as a step callback like Checkpointer: recorder(simulation), then recorder.close().
+    """
+
+    def __init__(self, filename, simulation, capacity, every=1, stars=None, dtype=np.float32, queue_size=8):
+        """
+        stars are the indices of the recorded stars (all by default).
+        At most queue_size frames wait for the writer thread, after which the simulation waits for it.
+        """
+        self.stars = record_stars(len(simulation.masses)) if stars is None else np.asarray(stars, dtype=np.int64)
+        self.every = every
+        self.trajectory = Trajectory.create(filename, capacity, self.stars, simulation.colors, every, dtype)
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._write_frames, daemon=True)
+        self.thread.start()
+
+    def _write_frames(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue # keep draining the queue so that the simulation never blocks
+            try:
+                self.trajectory.append(*item)
+            except Exception as error:  # reported by the simulation thread at the next frame
+                self.error = error
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def record(self, simulation):
+        """
+        Queue the current frame of simulation.
+        """
+        self._raise_error()
+        self.queue.put((simulation.positions[self.stars], simulation.step_count, simulation.time))
+
+    def __call__(self, simulation):
+        """
+        Step callback: record every self.every steps.
+        """
+        if self.every > 0 and simulation.step_count % self.every == 0:
+            self.record(simulation)
+
+    def close(self):
+        """
+        Write the queued frames, flush the file and stop the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.trajectory.flush()
+        self._raise_error()
@@ -0,0 +1,53 @@
+"""
+Ahead-of-time compilation of the numba kernels.
+
+The kernels of the numba engines are declared with explicit signatures (C-contiguous float64
+arrays) and cache=True: they are compiled when their module is imported, and the machine code
+is written to the numba cache (the __pycache__ directory next to the module, or NUMBA_CACHE_DIR
+if set). Later imports load it from disk instead of compiling, until the source file changes.
+
+    python -m galaxy warmup
+
+fills the cache once (after an install or an update), so that short batch jobs and interactive
+launches do not pay the compilation on their first step.
+"""
+import importlib
+import time
+
+from numba.core.dispatcher import Dispatcher
+
+KERNEL_MODULES = (
+    "galaxy_numba",
+    "rk4",
+    "verlet_barnes_hut_morse_version",
+    "verlet_barnes_hut_octree_version",
+    "galaxy_fmm",
+    "galaxy_pm",
+    "galaxy.render",
+)
+
+
+def compiled_kernels(module):
+    """
+    numba dispatchers of a module compiled with explicit signatures.
+    """
+    return [value for value in vars(module).values()
+            if isinstance(value, Dispatcher) and value.signatures]
+
+
+def warmup(modules=KERNEL_MODULES, log=print):
+    """
+    Import the kernel modules, which compiles their kernels or loads them from the cache.
+    Returns {module: (seconds, number of kernels, number of kernels loaded from the cache)}.
+    """
+    report = {}
+    for name in modules:
+        start_time = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - start_time
+        kernels = compiled_kernels(module)
+        cached = sum(1 for kernel in kernels if sum(kernel.stats.cache_hits.values()) > 0)
+        report[name] = (elapsed, len(kernels), cached)
+        if log is not None:
+            log(f"{name:36s} {len(kernels)} kernels, {cached} from cache, {elapsed:.3f} s")
+    return report
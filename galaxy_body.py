@@ -1,16 +1,59 @@
 import numpy as np
 import time
 from galaxy_generator import generate_star_color
-from visualizer3d_vbo import Visualizer3D
+from galaxy.loader import load_galaxy as read_galaxy
+from galaxy_vectorized import calculate_acceleration_blocked
 import sys
 
 G = 1.560339e-13 # Gravitationnal constant
+
+class BodyArrays:
+    """
+    Contiguous storage (structure of arrays) of the bodies of a system: body i is row i of each array.
+    """
+    __slots__ = ("masses", "positions", "velocities", "colors")
+
+    def __init__(self, masses, positions, velocities, colors):
+        self.masses = np.array(masses, dtype=np.float64)
+        self.positions = np.array(positions, dtype=np.float64).reshape(-1, 3)
+        self.velocities = np.array(velocities, dtype=np.float64).reshape(-1, 3)
+        self.colors = list(colors)
+
 class Body:
+    """
+    A body is a thin view on one row of a BodyArrays storage: position and velocity are views,
+    so updating them updates the arrays of the system the body belongs to.
+    A body created alone has its own one-row storage, until an NBodies system adopts it.
+    """
+    __slots__ = ("_arrays", "_index")
+
     def __init__(self, mass, position, velocity):
-        self.mass = mass
-        self.position = np.array(position, dtype=np.float64)
-        self.velocity = np.array(velocity, dtype=np.float64)
-        self.color = generate_star_color(mass)
+        self._arrays = BodyArrays([mass], [position], [velocity], [generate_star_color(mass)])
+        self._index = 0
+
+    @property
+    def mass(self):
+        return self._arrays.masses[self._index]
+
+    @property
+    def position(self):
+        return self._arrays.positions[self._index]
+
+    @position.setter
+    def position(self, value):
+        self._arrays.positions[self._index] = value
+
+    @property
+    def velocity(self):
+        return self._arrays.velocities[self._index]
+
+    @velocity.setter
+    def velocity(self, value):
+        self._arrays.velocities[self._index] = value
+
+    @property
+    def color(self):
+        return self._arrays.colors[self._index]
 
     def __str__(self):
         return f"Mass: {self.mass}, Position: {self.position}, Velocity: {self.velocity}, Color: {self.color}"
@@ -33,53 +76,59 @@ class NBodies:
     def __init__(self, bodies_list):
         """
         Initialize a system of bodies from a file containing their properties (mass, positionx, positiony, positionz, speedx, speedy, speedz).
+        The bodies are copied into one contiguous BodyArrays storage and become views on its rows.
         """
         self.collection = bodies_list
+        self.arrays = BodyArrays([body.mass for body in bodies_list],
+                                 [body.position for body in bodies_list],
+                                 [body.velocity for body in bodies_list],
+                                 [body.color for body in bodies_list])
+        for i, body in enumerate(bodies_list):
+            body._arrays = self.arrays
+            body._index = i
+
+    @property
+    def positions(self):
+        return self.arrays.positions
+
+    @property
+    def velocities(self):
+        return self.arrays.velocities
 
+    @property
+    def masses(self):
+        return self.arrays.masses
 
     def calculate_accelerations(self, body_i):
         """
-        Calculate the gravitational accelerations on each body due to all other bodies.
+        Calculate the gravitational acceleration on body_i due to all other bodies.
         """
-        total_acc = np.zeros(3)
-        
-        for body_j in self.collection:
-            if body_j is not body_i: # i != j
-                dist = body_j.distance(body_i)
-                if dist > 1e-10:
-                    diff = body_j.position - body_i.position
-                    total_acc += G * body_j.mass * diff / (dist**3)
-                
-        return total_acc
+        diff = self.positions - body_i.position
+        dist = np.linalg.norm(diff, axis=1)
+        mask = dist > 1e-10 # i != j, and avoid division by zero for very close bodies
+        return G * np.sum((self.masses[mask] / dist[mask]**3)[:, np.newaxis] * diff[mask], axis=0)
+
+    def accelerations(self):
+        """
+        Calculate the gravitational accelerations of all the bodies at once with the tiled vectorized kernel.
+        """
+        return calculate_acceleration_blocked(self.positions, self.masses)
 
     def step(self, dt):
         """
-        Performs one complete simulation step.
+        Performs one complete simulation step on the contiguous arrays (same update as Body.update).
         """
-        accels = []
-        for b in self.collection:
-            a = self.calculate_accelerations(b)
-            accels.append(a)
-        for i in range(len(self.collection)):
-            body = self.collection[i]
-            acc = accels[i]
-            body.update(acc, dt)                                                                                                             
-        return [body.position for body in self.collection]
+        acc = self.accelerations()
+        self.positions[:] += self.velocities * dt + 0.5 * acc * dt**2
+        self.velocities[:] += acc * dt
+        return self.positions
 
 def load_galaxy(filename):
         """
         Load a system of bodies from a file like (mass, positionx, positiony, positionz, speedx, speedy, speedz)
         """
-        bodies = []
-        with open(filename, 'r') as file:
-            for line in file:
-                data = list(map(float, line.split()))
-                mass = data[0]
-                position = data[1:4]
-                speed = data[4:7]
-                body = Body(mass, position, speed)
-                bodies.append(body)
-        return bodies
+        positions, speeds, masses, colors = read_galaxy(filename)
+        return [Body(mass, position, speed) for mass, position, speed in zip(masses, positions, speeds)]
 
 if __name__ == "__main__":
 
@@ -100,10 +149,11 @@ if __name__ == "__main__":
         print(f"Time for 10 steps ({len(system.collection)} bodies): {end_time - start_time:.4f} seconds")
     
     # Visualization
-    points = np.array([body.position for body in system.collection])
-    colors = np.array([body.color for body in system.collection])
+    points = system.positions
+    colors = np.array(system.arrays.colors)
     luminosities = np.ones(len(system.collection), dtype=np.float32)
     bounds = ((-3, 3), (-3, 3), (-3, 3))
 
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
     visualizer = Visualizer3D(points, colors, luminosities, bounds)
     visualizer.run(updater=system.step, dt=dt)
\ No newline at end of file
@@ -0,0 +1,339 @@
+import numpy as np
+import time
+from functools import lru_cache
+from galaxy.loader import load_galaxy
+from integrators import VelocityVerlet
+from verlet_barnes_hut_octree_version import build_octree
+import sys
+import numba
+
+G = 1.560339e-13  # Gravitational constant
+
+# Fast multipole method on the octree of verlet_barnes_hut_octree_version.py, with Cartesian Taylor expansions.
+#
+# For a cell B with expansion center zB, the multipole moments are M[n] = sum_j m_j (y_j - zB)^n / n!
+# for every multi-index n = (nx, ny, nz) with |n| = nx + ny + nz <= order.
+# Two cells A and B are well separated when (rA + rB) < theta * |zA - zB|, r being the radius of a cell
+# around its center. The field of B in A is then summed into the local expansion of A (M2L):
+#     L[m] += sum_n (-1)^|n| M[n] D[n + m](zA - zB),    D[k] = d^k (1 / |r|) / dr^k
+# and the acceleration of a star at x in A is G * grad(sum_m L[m] (x - zA)^m / m!) (L2P).
+# Multipoles are shifted from children to parents (M2M), local expansions from parents to children (L2L),
+# and stars of cells that are too close interact directly (P2P).
+# Cells interact with cells (dual tree walk), so the cost is O(N) for a given order and theta.
+#
+# The multi-indices are numbered by increasing total degree; the tables below give for each of them
+# its powers and the numbers of its neighbours (n - e_i, n - 2 e_i, n + e_i), and list the triples
+# (a, b, a + b) used by the M2L, M2M and L2L translations.
+
+
+@lru_cache(maxsize=None)
+def expansion_tables(order):
+    """
+    Multi-index tables for expansions up to the given order:
+    powers (T, 3), degree (T,), lower (T, 3), lower2 (T, 3), upper (T, 3), pairs (P, 3) and signs (P,).
+    lower[n, i], lower2[n, i] and upper[n, i] are the numbers of n - e_i, n - 2 e_i and n + e_i (-1 if they do not exist).
+    signs[q] is (-1)^|b| for the pair (a, b, a + b), the sign of the M2L term.
+    """
+    if order < 1:
+        raise ValueError(f"the expansion order must be at least 1, not {order}")
+    indices = [(nx, ny, total - nx - ny)
+               for total in range(order + 1) for nx in range(total, -1, -1) for ny in range(total - nx, -1, -1)]
+    number = {index: k for k, index in enumerate(indices)}
+
+    def neighbour(index, axis, shift):
+        moved = list(index)
+        moved[axis] += shift
+        return number.get(tuple(moved), -1)
+
+    powers = np.array(indices, dtype=np.int64)
+    degree = powers.sum(axis=1)
+    lower = np.array([[neighbour(index, i, -1) for i in range(3)] for index in indices], dtype=np.int64)
+    lower2 = np.array([[neighbour(index, i, -2) for i in range(3)] for index in indices], dtype=np.int64)
+    upper = np.array([[neighbour(index, i, 1) for i in range(3)] for index in indices], dtype=np.int64)
+    pairs = np.array([(number[a], number[b], number[tuple(np.add(a, b))])
+                      for a in indices for b in indices if sum(a) + sum(b) <= order], dtype=np.int64)
+    signs = np.where(degree[pairs[:, 1]] % 2 == 1, -1.0, 1.0)
+    return powers, degree, lower, lower2, upper, pairs, signs
+
+
+@numba.njit("(f8, f8, f8, i8[:, ::1], i8[:, ::1], f8[::1])", cache=True, nogil=True)
+def monomials(dx, dy, dz, powers, lower, out):
+    """
+    out[j] = d^j / j! for every multi-index j, each one from a lower one: d^j / j! = d^(j - e_i) / (j - e_i)! * d_i / j_i
+    """
+    d = (dx, dy, dz)
+    out[0] = 1.0
+    for j in range(1, out.shape[0]):
+        for i in range(3):
+            if lower[j, i] >= 0:
+                out[j] = out[lower[j, i]] * d[i] / powers[j, i]
+                break
+
+
+@numba.njit("(f8, f8, f8, i8[:, ::1], i8[::1], i8[:, ::1], i8[:, ::1], f8[::1])", cache=True, nogil=True)
+def derivatives(rx, ry, rz, powers, degree, lower, lower2, out):
+    """
+    out[n] = d^n (1 / |r|) / dr^n for every multi-index n, with the recurrence
+    |n| r^2 D[n] = -(2|n| - 1) sum_i n_i r_i D[n - e_i] - (|n| - 1) sum_i n_i (n_i - 1) D[n - 2 e_i]
+    """
+    r = (rx, ry, rz)
+    dist2 = rx*rx + ry*ry + rz*rz
+    out[0] = 1.0 / np.sqrt(dist2)
+    for n in range(1, out.shape[0]):
+        s1 = 0.0
+        s2 = 0.0
+        for i in range(3):
+            ni = powers[n, i]
+            if ni >= 1:
+                s1 += ni * r[i] * out[lower[n, i]]
+            if ni >= 2:
+                s2 += ni * (ni - 1) * out[lower2[n, i]]
+        k = degree[n]
+        out[n] = -((2*k - 1) * s1 + (k - 1) * s2) / (k * dist2)
+
+
+@numba.njit("(i8[::1], b1[::1], i8)", cache=True, nogil=True)
+def tree_tasks(node_next, node_leaf, task_depth):
+    """
+    Parent of every node, and the nodes at depth task_depth (or leaves above it), whose subtrees
+    partition the stars and are processed in parallel.
+    """
+    n_nodes = node_next.shape[0]
+    parent = np.full(n_nodes, -1, dtype=np.int64)
+    depth = np.zeros(n_nodes, dtype=np.int64)
+    for k in range(n_nodes):
+        if not node_leaf[k]:
+            c = k + 1
+            while c < node_next[k]:
+                parent[c] = k
+                depth[c] = depth[k] + 1
+                c = node_next[c]
+
+    n_tasks = 0
+    tasks = np.empty(n_nodes, dtype=np.int64)
+    for k in range(n_nodes):
+        if depth[k] == task_depth or (depth[k] < task_depth and node_leaf[k]):
+            tasks[n_tasks] = k
+            n_tasks += 1
+    return parent, tasks[:n_tasks]
+
+
+@numba.njit("(f8[:, ::1], f8[::1], i8[::1], i8[::1], i8[::1], i8[::1], b1[::1], i8[::1], i8[:, ::1], i8[:, ::1], i8[:, ::1])",
+            parallel=True, cache=True, nogil=True)
+def upward_pass(positions, mass, order, node_start, node_end, node_next, node_leaf, parent, powers, lower, pairs):
+    """
+    Expansion center (center of mass), radius and multipole moments of every node:
+    P2M in the leaves (in parallel), then M2M from children to parents in reverse pre-order.
+    """
+    n_nodes = node_start.shape[0]
+    n_terms = powers.shape[0]
+    node_com = np.zeros((n_nodes, 3), dtype=np.float64)
+    node_radius = np.zeros(n_nodes, dtype=np.float64)
+    multipoles = np.zeros((n_nodes, n_terms), dtype=np.float64)
+
+    # Centers of mass, from the stars of each node (each node reads its own range of stars)
+    for k in numba.prange(n_nodes):
+        cx, cy, cz = 0.0, 0.0, 0.0
+        total_mass = 0.0
+        for s in range(node_start[k], node_end[k]):
+            j = order[s]
+            cx += positions[j, 0] * mass[j]
+            cy += positions[j, 1] * mass[j]
+            cz += positions[j, 2] * mass[j]
+            total_mass += mass[j]
+        if total_mass > 0.0:
+            node_com[k, 0] = cx / total_mass
+            node_com[k, 1] = cy / total_mass
+            node_com[k, 2] = cz / total_mass
+
+    # P2M and radius of the leaves
+    for k in numba.prange(n_nodes):
+        if not node_leaf[k]:
+            continue
+        t = np.empty(n_terms, dtype=np.float64)
+        radius2 = 0.0
+        for s in range(node_start[k], node_end[k]):
+            j = order[s]
+            dx = positions[j, 0] - node_com[k, 0]
+            dy = positions[j, 1] - node_com[k, 1]
+            dz = positions[j, 2] - node_com[k, 2]
+            radius2 = max(radius2, dx*dx + dy*dy + dz*dz)
+            monomials(dx, dy, dz, powers, lower, t)
+            for n in range(n_terms):
+                multipoles[k, n] += mass[j] * t[n]
+        node_radius[k] = np.sqrt(radius2)
+
+    # M2M: children are after their parent in pre-order, so a reverse sweep completes them first
+    t = np.empty(n_terms, dtype=np.float64)
+    for k in range(n_nodes - 1, 0, -1):
+        p = parent[k]
+        dx = node_com[k, 0] - node_com[p, 0]
+        dy = node_com[k, 1] - node_com[p, 1]
+        dz = node_com[k, 2] - node_com[p, 2]
+        node_radius[p] = max(node_radius[p], node_radius[k] + np.sqrt(dx*dx + dy*dy + dz*dz))
+        monomials(dx, dy, dz, powers, lower, t)
+        for q in range(pairs.shape[0]):
+            multipoles[p, pairs[q, 2]] += multipoles[k, pairs[q, 0]] * t[pairs[q, 1]]
+
+    return node_com, node_radius, multipoles
+
+
+@numba.njit("(f8[:, ::1], f8[::1], i8[::1], i8[::1], i8[::1], i8[::1], b1[::1], i8[::1], i8[::1], "
+            "f8[:, ::1], f8[::1], f8[:, ::1], f8, i8[:, ::1], i8[::1], i8[:, ::1], i8[:, ::1], i8[:, ::1], i8[:, ::1], f8[::1])",
+            parallel=True, cache=True, nogil=True)
+def dual_tree_walk(positions, mass, order, node_start, node_end, node_next, node_leaf, parent, tasks,
+                   node_com, node_radius, multipoles, theta, powers, degree, lower, lower2, upper, pairs, signs):
+    """
+    Accelerations of the stars, each task subtree (target cells) being processed by one thread:
+    - walk the pairs (target A, source B), starting from (task, root), with an explicit stack:
+      well separated pairs go through M2L, pairs of leaves through P2P, other pairs are split
+      (the leaf or the larger cell is replaced by its children)
+    - then shift the local expansions down the subtree (L2L) and evaluate them at the stars (L2P).
+    Only the cells and stars of the task subtree are written, so the tasks are independent.
+    """
+    n = positions.shape[0]
+    n_terms = powers.shape[0]
+    n_nodes = node_start.shape[0]
+    accelerations = np.zeros((n, 3), dtype=np.float64)
+    local = np.zeros((n_nodes, n_terms), dtype=np.float64)
+    theta2 = theta * theta
+
+    for task_number in numba.prange(tasks.shape[0]):
+        task = tasks[task_number]
+        d = np.empty(n_terms, dtype=np.float64)
+        t = np.empty(n_terms, dtype=np.float64)
+        stack = np.empty((64, 2), dtype=np.int64)
+        stack[0, 0] = task
+        stack[0, 1] = 0
+        top = 1
+
+        while top > 0:
+            top -= 1
+            a, b = stack[top, 0], stack[top, 1]
+            rx = node_com[a, 0] - node_com[b, 0]
+            ry = node_com[a, 1] - node_com[b, 1]
+            rz = node_com[a, 2] - node_com[b, 2]
+            dist2 = rx*rx + ry*ry + rz*rz
+            reach = node_radius[a] + node_radius[b]
+
+            if reach * reach < theta2 * dist2: # Well separated : M2L
+                derivatives(rx, ry, rz, powers, degree, lower, lower2, d)
+                for q in range(pairs.shape[0]):
+                    local[a, pairs[q, 0]] += signs[q] * multipoles[b, pairs[q, 1]] * d[pairs[q, 2]]
+
+            elif node_leaf[a] and node_leaf[b]: # Close leaves : P2P
+                for s in range(node_start[a], node_end[a]):
+                    i = order[s]
+                    px, py, pz = positions[i, 0], positions[i, 1], positions[i, 2]
+                    ax, ay, az = 0.0, 0.0, 0.0
+                    for u in range(node_start[b], node_end[b]):
+                        j = order[u]
+                        if i == j:
+                            continue
+                        dx = positions[j, 0] - px
+                        dy = positions[j, 1] - py
+                        dz = positions[j, 2] - pz
+                        dist = np.sqrt(dx*dx + dy*dy + dz*dz)
+                        if dist > 1e-10:
+                            f = G * mass[j] / (dist**3)
+                            ax += f * dx
+                            ay += f * dy
+                            az += f * dz
+                    accelerations[i, 0] += ax
+                    accelerations[i, 1] += ay
+                    accelerations[i, 2] += az
+
+            else: # Replace the larger cell (or the one which is not a leaf) by its children
+                split_a = node_leaf[b] or (not node_leaf[a] and node_radius[a] > node_radius[b])
+                parent_node = a if split_a else b
+                c = parent_node + 1
+                while c < node_next[parent_node]:
+                    if top == stack.shape[0]:
+                        bigger = np.empty((2 * top, 2), dtype=np.int64)
+                        bigger[:top] = stack
+                        stack = bigger
+                    stack[top, 0] = c if split_a else a
+                    stack[top, 1] = b if split_a else c
+                    top += 1
+                    c = node_next[c]
+
+        # L2L then L2P, in pre-order so that parents are complete before their children
+        for k in range(task, node_next[task]):
+            if k != task:
+                p = parent[k]
+                monomials(node_com[k, 0] - node_com[p, 0], node_com[k, 1] - node_com[p, 1],
+                          node_com[k, 2] - node_com[p, 2], powers, lower, t)
+                for q in range(pairs.shape[0]):
+                    local[k, pairs[q, 0]] += local[p, pairs[q, 2]] * t[pairs[q, 1]]
+            if not node_leaf[k]:
+                continue
+            for s in range(node_start[k], node_end[k]):
+                i = order[s]
+                monomials(positions[i, 0] - node_com[k, 0], positions[i, 1] - node_com[k, 1],
+                          positions[i, 2] - node_com[k, 2], powers, lower, t)
+                ax, ay, az = 0.0, 0.0, 0.0
+                for m in range(n_terms):
+                    if upper[m, 0] >= 0:
+                        ax += local[k, upper[m, 0]] * t[m]
+                        ay += local[k, upper[m, 1]] * t[m]
+                        az += local[k, upper[m, 2]] * t[m]
+                accelerations[i, 0] += G * ax
+                accelerations[i, 1] += G * ay
+                accelerations[i, 2] += G * az
+
+    return accelerations
+
+
+def calculate_acceleration(positions, mass, order=4, theta=0.6, leaf_size=64, task_depth=3):
+    """
+    Compute gravitational acceleration with the fast multipole method.
+    order is the expansion order (higher is more accurate and more expensive per interaction),
+    theta the opening criterion : cells of radii rA and rB interact through their expansions when
+    (rA + rB) < theta * distance, smaller values being more accurate and slower.
+    """
+    positions = np.require(positions, np.float64, ["C", "W"]) # the kernels only take C-contiguous float64 arrays
+    mass = np.require(mass, np.float64, ["C", "W"])
+    powers, degree, lower, lower2, upper, pairs, signs = expansion_tables(order)
+    tree_order, node_start, node_end, node_size, node_center, node_next, node_leaf = build_octree(positions, leaf_size)
+    parent, tasks = tree_tasks(node_next, node_leaf, task_depth)
+    node_com, node_radius, multipoles = upward_pass(positions, mass, tree_order, node_start, node_end, node_next,
+                                                    node_leaf, parent, powers, lower, pairs)
+    return dual_tree_walk(positions, mass, tree_order, node_start, node_end, node_next, node_leaf, parent, tasks,
+                          node_com, node_radius, multipoles, theta, powers, degree, lower, lower2, upper, pairs, signs)
+
+
+def step(dt):
+    """
+    Updates the all the positions in the system after a time step dt using the Verlet integration method.
+    The integrator keeps the end-of-step acceleration, so each step needs one force evaluation.
+    """
+    global integrator
+    return integrator.step(dt)
+
+
+if __name__ == "__main__":
+    global positions, velocity, mass, color, integrator
+
+    galaxy_file = "data/galaxy_{}".format(sys.argv[2] if len(sys.argv) > 2 else "100")
+    positions, velocity, mass, color = load_galaxy(galaxy_file)
+
+    dt = float(sys.argv[1]) if len(sys.argv) > 1 else 1e-3
+    expansion_order = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    integrator = VelocityVerlet(positions, velocity, lambda pos: calculate_acceleration(pos, mass, expansion_order))
+    positions = integrator.positions
+
+    # Time the execution of 10 steps
+    start_time = time.time()
+    for _ in range(10):
+        step(dt)
+    end_time = time.time()
+    print(f"Time for 10 steps ({len(mass)} bodies): {end_time - start_time:.4f} seconds\n")
+
+    # Visualization
+    luminosities = np.ones(len(positions), dtype=np.float32)
+    bounds = ((-3, 3), (-3, 3), (-3, 3))
+
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
+    visualizer = Visualizer3D(positions, color, luminosities, bounds)
+    visualizer.run(updater=step, dt=dt)
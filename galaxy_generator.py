@@ -117,6 +117,168 @@ def generate_star_color(mass):
         return (255, 150, 100)
 
 
+def generate_star_colors(masses):
+    """
+    Version vectorisée de generate_star_color pour un tableau de masses.
+    
+    Parameters:
+    -----------
+    masses : np.array
+        Masses des étoiles en masses solaires, shape (N,)
+    
+    Returns:
+    --------
+    colors : np.array
+        Couleurs RGB (R, G, B) avec des valeurs entre 0 et 255, shape (N, 3)
+    """
+    masses = np.asarray(masses)
+    # Même ordre que dans generate_star_color : bleu-blanc, blanc, jaune, rouge-orange
+    palette = np.array([(150, 180, 255), (255, 255, 255), (255, 255, 200), (255, 150, 100)])
+    index = np.select([masses > 5.0, masses > 2.0, masses > 1.0], [0, 1, 2], default=3)
+    return palette[index]
+
+
+def generate_stable_orbits(rng, black_hole_mass, n_stars, star_mass_range=(0.5, 10.0),
+                           min_radius=0.001, max_radius=1.0):
+    """
+    Version vectorisée de generate_stable_orbit : génère d'un coup n_stars étoiles
+    (masse, position et vitesse) avec les mêmes distributions.
+    
+    Parameters:
+    -----------
+    rng : np.random.Generator
+        Générateur de nombres aléatoires
+    black_hole_mass : float
+        Masse du trou noir central (en masses solaires)
+    n_stars : int
+        Nombre d'étoiles à générer
+    star_mass_range : tuple
+        Plage de masses pour les étoiles (min, max) en masses solaires
+    min_radius : float
+        Rayon minimal de l'orbite (en années-lumière)
+    max_radius : float
+        Rayon maximal de l'orbite (en années-lumière)
+    
+    Returns:
+    --------
+    masses : np.array
+        Masses des étoiles, shape (n_stars,)
+    positions : np.array
+        Positions 3D en années-lumière, shape (n_stars, 3)
+    velocities : np.array
+        Vitesses 3D en années-lumière par an, shape (n_stars, 3)
+    """
+    masses = rng.uniform(star_mass_range[0], star_mass_range[1], n_stars)
+    radius = rng.uniform(min_radius, max_radius, n_stars)
+    theta = rng.uniform(0, 2 * np.pi, n_stars)
+    inclination = rng.normal(0, 0.1, n_stars)
+    
+    positions = np.empty((n_stars, 3))
+    positions[:, 0] = radius * np.cos(theta)
+    positions[:, 1] = radius * np.sin(theta)
+    positions[:, 2] = radius * np.sin(inclination)
+    
+    # Vitesse orbitale circulaire corrigée par l'excentricité
+    r = np.sqrt(np.einsum("ij,ij->i", positions, positions))
+    eccentricity = rng.uniform(0.0, 0.7, n_stars)
+    v_magnitude = np.sqrt(G * black_hole_mass / r) * np.sqrt(1 + eccentricity)
+    
+    # Direction tangentielle (-y, x, 0) normalisée, plus une faible composante verticale
+    r_plane = np.hypot(positions[:, 0], positions[:, 1])
+    r_plane[r_plane == 0] = np.inf
+    velocities = np.empty((n_stars, 3))
+    velocities[:, 0] = -positions[:, 1] / r_plane * v_magnitude
+    velocities[:, 1] = positions[:, 0] / r_plane * v_magnitude
+    velocities[:, 2] = rng.normal(0, 0.05, n_stars) * v_magnitude
+    
+    return masses, positions, velocities
+
+
+def generate_galaxy_chunked(n_stars,
+                            output_file,
+                            black_hole_mass=None,
+                            star_mass_range=(0.5, 10.0),
+                            min_orbital_radius=0.001,
+                            max_orbital_radius=1.0,
+                            seed=None,
+                            binary=False,
+                            chunk_size=1_000_000):
+    """
+    Génère une galaxie par paquets de chunk_size étoiles et l'écrit au fur et à mesure
+    dans output_file : la mémoire utilisée ne dépend pas de n_stars.
+    
+    Parameters:
+    -----------
+    n_stars : int
+        Nombre d'étoiles à générer
+    output_file : str
+        Nom du fichier de sortie
+    black_hole_mass : float, optional
+        Masse du trou noir central en masses solaires (si None, générée aléatoirement)
+    star_mass_range : tuple
+        Plage de masses pour les étoiles (min, max) en masses solaires
+    min_orbital_radius : float
+        Rayon orbital minimum (en années-lumière)
+    max_orbital_radius : float
+        Rayon orbital maximum (en années-lumière)
+    seed : int, optional
+        Graine du générateur aléatoire (même graine = même galaxie)
+    binary : bool
+        Si True, écrit un snapshot binaire (voir galaxy.snapshot), sinon un fichier texte
+    chunk_size : int
+        Nombre d'étoiles générées et écrites à la fois
+    
+    Returns:
+    --------
+    stats : dict
+        Masse du trou noir, masse totale, masse moyenne des étoiles et distances min/max
+    """
+    rng = np.random.default_rng(seed)
+    if black_hole_mass is None:
+        black_hole_mass = rng.uniform(1e5, 1e10)
+    
+    stats = {"black_hole_mass": black_hole_mass, "total_mass": black_hole_mass,
+             "min_distance": np.inf, "max_distance": 0.0}
+    
+    if binary:
+        from galaxy.snapshot import create_snapshot  # import local : galaxy importe ce module
+        out_mass, out_positions, out_velocities = create_snapshot(output_file, n_stars + 1, seed=seed)
+        # Trou noir central (position et vitesse nulles)
+        out_mass[0] = black_hole_mass
+        out_positions[0] = 0.0
+        out_velocities[0] = 0.0
+    else:
+        file = open(output_file, "w")
+        file.write(f"{black_hole_mass:.6e} " + " ".join(["0.000000e+00"] * 6) + "\n")
+    
+    line_format = "%.6e %.6e %.6e %.6e %.6e %.6e %.6e\n"
+    try:
+        for start in range(0, n_stars, chunk_size):
+            count = min(chunk_size, n_stars - start)
+            masses, positions, velocities = generate_stable_orbits(rng, black_hole_mass, count, star_mass_range,
+                                                                   min_orbital_radius, max_orbital_radius)
+            if binary:
+                out_mass[1 + start:1 + start + count] = masses
+                out_positions[1 + start:1 + start + count] = positions
+                out_velocities[1 + start:1 + start + count] = velocities
+                out_mass.flush()
+            else:
+                # Format: masse px py pz vx vy vz, formaté en une seule fois pour tout le paquet
+                rows = np.column_stack((masses, positions, velocities))
+                file.write((line_format * count) % tuple(rows.ravel()))
+            
+            distances = np.sqrt(np.einsum("ij,ij->i", positions, positions))
+            stats["total_mass"] += masses.sum()
+            stats["min_distance"] = min(stats["min_distance"], distances.min())
+            stats["max_distance"] = max(stats["max_distance"], distances.max())
+    finally:
+        if not binary:
+            file.close()
+    
+    stats["mean_star_mass"] = (stats["total_mass"] - black_hole_mass) / max(n_stars, 1)
+    return stats
+
+
 def generate_galaxy(n_stars, 
                    black_hole_mass=None,
                    star_mass_range=(0.5, 10.0),
@@ -204,31 +366,39 @@ def generate_galaxy(n_stars,
 def main():
     """
     Fonction principale pour tester le générateur de galaxie.
+    Un fichier de sortie terminé par .snap est écrit au format binaire.
     """
     import sys
     
     # Paramètres par défaut
     n_stars = 100
     output_file = "data/galaxy_100"
+    seed = None
     
     # Lecture des arguments de ligne de commande
     if len(sys.argv) > 1:
         n_stars = int(sys.argv[1])
     if len(sys.argv) > 2:
         output_file = sys.argv[2]
+    if len(sys.argv) > 3:
+        seed = int(sys.argv[3])
     
     # Génération de la galaxie
-    masses, positions, velocities, colors = generate_galaxy(
+    stats = generate_galaxy_chunked(
         n_stars=n_stars,
-        output_file=output_file
+        output_file=output_file,
+        seed=seed,
+        binary=output_file.endswith(".snap")
     )
     
+    print(f"Galaxie générée avec {n_stars} étoiles et sauvegardée dans '{output_file}'")
+    print(f"Masse du trou noir central: {stats['black_hole_mass']:.2e} masses solaires")
     print(f"\nStatistiques de la galaxie:")
-    print(f"  - Nombre total d'objets: {len(masses)}")
+    print(f"  - Nombre total d'objets: {n_stars + 1}")
     print(f"  - Nombre d'étoiles: {n_stars}")
-    print(f"  - Masse totale: {sum(masses):.2e} masses solaires")
-    print(f"  - Masse moyenne des étoiles: {np.mean(masses[1:]):.2f} masses solaires")
-    print(f"  - Distance min/max: {min(np.linalg.norm(p) for p in positions[1:]):.4f} / {max(np.linalg.norm(p) for p in positions[1:]):.4f} années-lumière")
+    print(f"  - Masse totale: {stats['total_mass']:.2e} masses solaires")
+    print(f"  - Masse moyenne des étoiles: {stats['mean_star_mass']:.2f} masses solaires")
+    print(f"  - Distance min/max: {stats['min_distance']:.4f} / {stats['max_distance']:.4f} années-lumière")
 
 
 if __name__ == "__main__":
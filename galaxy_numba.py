@@ -1,70 +1,209 @@
 import numpy as np
 import time
-from galaxy_generator import generate_star_color
-from visualizer3d_vbo import Visualizer3D
+from galaxy.loader import load_galaxy
 import sys
 import numba
 
 G = 1.560339e-13 # Gravitationnal constant
 
-@numba.njit(parallel=True)
-def calculate_acceleration(position, velocity, mass):
+# The kernels are compiled at import for C-contiguous float64 arrays (explicit signatures)
+# and cached in __pycache__ (cache=True, nogil=True): only the first run after a change compiles them.
+# Other arrays (float32, slices, read-only snapshots) are converted with kernel_input before calling them.
+
+
+def kernel_input(array):
+    """
+    array as a writable C-contiguous float64 array, the only type the kernels are compiled for
+    (no copy if it already is one).
+    """
+    return np.require(array, np.float64, ["C", "W"])
+
+
+@numba.njit("(f8[:, ::1], f8[:, ::1], f8[::1], f8, f8[:, ::1], f8[:, ::1])", parallel=True, cache=True, nogil=True)
+def fused_step(position, velocity, mass, dt, new_position, new_velocity):
     """
-    Calculate the gravitational accelerations on each body due to all other bodies.
-    Based on this formula : accel[i] = f[i] / m[i] 
+    Fused "force + kick + drift" step: compute the acceleration of each body and update it at once,
+    writing into the preallocated new_position and new_velocity arrays (which must not alias the inputs).
+    Based on this formula : accel[i] = f[i] / m[i], then
+    p(t+dt) = p(t) + dt*v(t) + 0.5 * dt^2 * a(t)
+    v(t+dt) = v(t) + dt * a(t)
     """
     n = position.shape[0]
-    new_pos = np.empty_like(position)
-    new_vel = np.empty_like(velocity)
+    half_dt2 = 0.5 * dt * dt
 
     for i in numba.prange(n):
-        acc = np.zeros(3)
+        ax, ay, az = 0.0, 0.0, 0.0
         for j in range(n):
             if i == j:
                 continue
-            diff = position[j] - position[i]
-            dist = np.sqrt(diff[0]*diff[0] + diff[1]*diff[1] + diff[2]*diff[2])
+            dx = position[j, 0] - position[i, 0]
+            dy = position[j, 1] - position[i, 1]
+            dz = position[j, 2] - position[i, 2]
+            dist = np.sqrt(dx*dx + dy*dy + dz*dz)
             if dist > 1e-10:
-                acc += G * mass[j] * diff / (dist**3)
-        new_pos[i] = position[i] + velocity[i] * dt + 0.5 * acc * dt**2
-        new_vel[i] = velocity[i] + acc * dt
+                f = G * mass[j] / (dist**3)
+                ax += f * dx
+                ay += f * dy
+                az += f * dz
+        new_position[i, 0] = position[i, 0] + velocity[i, 0] * dt + ax * half_dt2
+        new_position[i, 1] = position[i, 1] + velocity[i, 1] * dt + ay * half_dt2
+        new_position[i, 2] = position[i, 2] + velocity[i, 2] * dt + az * half_dt2
+        new_velocity[i, 0] = velocity[i, 0] + ax * dt
+        new_velocity[i, 1] = velocity[i, 1] + ay * dt
+        new_velocity[i, 2] = velocity[i, 2] + az * dt
 
-    return new_pos, new_vel
 
-def step(dt):
+class DoubleBuffer:
     """
-    Updates the all the positions in the system after a time step dt.
+    Positions and velocities stored in two pairs of buffers allocated once: each step reads the
+    front pair, writes the back pair with fused_step, then swaps them.
+    The positions returned by a step are not modified by the next step (which writes the other
+    buffer), so a render thread can draw the previous frame without copying it while the next one
+    is computed. They are overwritten by the step after.
+    """
+
+    def __init__(self, position, velocity, mass):
+        self.positions = (np.array(position, dtype=np.float64), np.empty((len(mass), 3)))
+        self.velocities = (np.array(velocity, dtype=np.float64), np.empty((len(mass), 3)))
+        self.mass = np.array(mass, dtype=np.float64)
+        self.front = 0
+
+    @property
+    def position(self):
+        return self.positions[self.front]
+
+    @property
+    def velocity(self):
+        return self.velocities[self.front]
+
+    def step(self, dt):
+        back = 1 - self.front
+        fused_step(self.positions[self.front], self.velocities[self.front], self.mass, dt,
+                   self.positions[back], self.velocities[back])
+        self.front = back
+        return self.positions[back]
+
+@numba.njit("(f8[:, ::1], f8[::1])", parallel=True, cache=True, nogil=True)
+def direct_acceleration(position, mass):
+    """
+    Calculate the gravitational accelerations on each body due to all other bodies, without updating them.
+    Based on this formula : accel[i] = f[i] / m[i]
+    """
+    n = position.shape[0]
+    accelerations = np.zeros((n, 3))
+
+    for i in numba.prange(n):
+        ax, ay, az = 0.0, 0.0, 0.0
+        for j in range(n):
+            if i == j:
+                continue
+            dx = position[j, 0] - position[i, 0]
+            dy = position[j, 1] - position[i, 1]
+            dz = position[j, 2] - position[i, 2]
+            dist = np.sqrt(dx*dx + dy*dy + dz*dz)
+            if dist > 1e-10:
+                f = G * mass[j] / (dist**3)
+                ax += f * dx
+                ay += f * dy
+                az += f * dz
+        accelerations[i, 0] = ax
+        accelerations[i, 1] = ay
+        accelerations[i, 2] = az
+
+    return accelerations
+
+@numba.njit("(f8[:, ::1], f8[::1], i8[::1])", parallel=True, cache=True, nogil=True)
+def subset_acceleration(position, mass, active):
+    """
+    Same as direct_acceleration for the bodies of indices active only (block time steps).
+    Returns an array of shape (len(active), 3).
+    """
+    n = position.shape[0]
+    accelerations = np.zeros((active.shape[0], 3))
+
+    for k in numba.prange(active.shape[0]):
+        i = active[k]
+        ax, ay, az = 0.0, 0.0, 0.0
+        for j in range(n):
+            if i == j:
+                continue
+            dx = position[j, 0] - position[i, 0]
+            dy = position[j, 1] - position[i, 1]
+            dz = position[j, 2] - position[i, 2]
+            dist = np.sqrt(dx*dx + dy*dy + dz*dz)
+            if dist > 1e-10:
+                f = G * mass[j] / (dist**3)
+                ax += f * dx
+                ay += f * dy
+                az += f * dz
+        accelerations[k, 0] = ax
+        accelerations[k, 1] = ay
+        accelerations[k, 2] = az
+
+    return accelerations
+
+def symmetric_acceleration(position, mass):
+    """
+    Calculate the gravitational accelerations using Newton's third law : each pair (i, j) with i < j
+    is visited once and gives equal and opposite contributions to i and j.
+    Each thread accumulates into its own private array (no write conflict), rows i being dealt
+    cyclically to the threads to balance the triangular loop, and the private arrays are summed at the end.
     """
-    global position, velocity, mass
-    new_position, new_velocity = calculate_acceleration(position, velocity, mass)
-    # updater doesn't edit variables, returns new values
-    position = new_position
-    velocity = new_velocity
-    return position
+    return symmetric_kernel(kernel_input(position), kernel_input(mass), numba.get_num_threads())
 
+# The thread count is an argument: calling numba.get_num_threads() inside the kernel would prevent caching it
+@numba.njit("(f8[:, ::1], f8[::1], i8)", parallel=True, cache=True, nogil=True)
+def symmetric_kernel(position, mass, n_threads):
+    n = position.shape[0]
+    partial = np.zeros((n_threads, n, 3))
+
+    for t in numba.prange(n_threads):
+        for i in range(t, n, n_threads):
+            xi, yi, zi = position[i, 0], position[i, 1], position[i, 2]
+            mi = mass[i]
+            ax, ay, az = 0.0, 0.0, 0.0
+            for j in range(i + 1, n):
+                dx = position[j, 0] - xi
+                dy = position[j, 1] - yi
+                dz = position[j, 2] - zi
+                dist2 = dx*dx + dy*dy + dz*dz
+                dist = np.sqrt(dist2)
+                if dist > 1e-10:
+                    g = G / (dist2 * dist)
+                    fi = g * mass[j] # pull of j on i
+                    ax += fi * dx
+                    ay += fi * dy
+                    az += fi * dz
+                    fj = g * mi # opposite pull of i on j
+                    partial[t, j, 0] -= fj * dx
+                    partial[t, j, 1] -= fj * dy
+                    partial[t, j, 2] -= fj * dz
+            partial[t, i, 0] += ax
+            partial[t, i, 1] += ay
+            partial[t, i, 2] += az
 
-def load_galaxy(filename):
+    accelerations = np.zeros((n, 3))
+    for i in numba.prange(n):
+        for t in range(n_threads):
+            accelerations[i, 0] += partial[t, i, 0]
+            accelerations[i, 1] += partial[t, i, 1]
+            accelerations[i, 2] += partial[t, i, 2]
+
+    return accelerations
+
+def step(dt):
     """
-    Load a system of bodies from a file like (mass, positionx, positiony, positionz, velocityx, velocityy, velocityz)
+    Updates the all the positions in the system after a time step dt.
     """
-    position = [] # [[0, 0, 0], [0, 0, 0], ...]
-    velocity = [] # [[0, 0, 0], [0, 0, 0], ...]
-    color = []  # [(255, 255, 255), (255, 255, 255), ...]
-    mass = [] # [1.0, 1.0, ...]
-
-    with open(filename, 'r') as file:
-        for line in file:
-            data = list(map(float, line.split()))
-            position.append(data[1:4])
-            velocity.append(data[4:7])
-            color.append(generate_star_color(data[0]))
-            mass.append(data[0])
-    return np.array(position), np.array(velocity), np.array(mass), np.array(color)
+    global buffers
+    return buffers.step(dt)
+
 
 if __name__ == "__main__":
 
-    global position, velocity, mass, color
+    global position, velocity, mass, color, buffers
     position, velocity, mass, color  = load_galaxy("data/galaxy_{}".format(sys.argv[2] if len(sys.argv) > 2 else "100"))
+    buffers = DoubleBuffer(position, velocity, mass)
     
     dt = float(sys.argv[1]) if len(sys.argv) > 1 else 1e-2
 
@@ -79,5 +218,6 @@ if __name__ == "__main__":
     luminosities = np.ones(len(position), dtype=np.float32)
     bounds = ((-3, 3), (-3, 3), (-3, 3))
 
-    visualizer = Visualizer3D(position, color, luminosities, bounds)
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
+    visualizer = Visualizer3D(buffers.position, color, luminosities, bounds)
     visualizer.run(updater=step, dt=dt)
\ No newline at end of file
@@ -0,0 +1,317 @@
+import numpy as np
+import time
+import math
+from functools import lru_cache
+from galaxy.loader import load_galaxy
+from integrators import VelocityVerlet
+import sys
+import numba
+
+G = 1.560339e-13  # Gravitational constant
+
+# Particle-mesh (PM) solver : the masses are deposited on a cubic mesh of n^3 cells of size h with the
+# cloud-in-cell (CIC) scheme, the potential is the convolution of the mesh density with the Green's
+# function -1/r, computed with FFTs, and the accelerations are interpolated back to the stars (CIC again)
+# from the 4-point finite differences of the potential.
+#
+# The system is isolated (no periodic images) : the mesh is zero-padded to (2n)^3 and the Green's function
+# is tabulated in real space on the padded mesh, so the circular convolution of the FFT equals the
+# linear one on the n^3 cells holding the stars (Hockney & Eastwood).
+# In units of cells the Green's function does not depend on h (phi = G / h * sum m_j K(cells)), so its
+# FFT is computed once per mesh size and cached.
+#
+# The cost is O(N + n^3 log n) whatever the clustering, but the force is smoothed below a few cells.
+# With P3M, the Green's function is split at the scale rs : the mesh only carries the long-range part
+# -erf(r / 2rs) / r, and stars closer than the cutoff add the short-range part exactly, found with a
+# CSR neighbor grid (same layout as grid_matrice_crs in verlet_barnes_hut_morse_version.py) of cells
+# of the size of the cutoff.
+
+CELL_SELF_POTENTIAL = 2.3800774  # -K(0) : potential at the center of a uniform cube of unit side and mass
+SHORT_RANGE_EXTENT = 25 # u^2 beyond which the short-range force is neglected
+SHORT_RANGE_POINTS = 4096 # points of the short-range table per unit of u^2
+MIN_EXTENT = 1e-3 # smallest mesh size in light-years, for stars that (almost) coincide
+
+
+@lru_cache(maxsize=4)
+def green_function(n_mesh, split=0.0):
+    """
+    FFT (rfftn) of the isolated Green's function on the (2 n_mesh)^3 padded mesh, in units of cells.
+    With split > 0, long-range part -erf(r / 2 split) / r of the P3M decomposition (split in cells),
+    divided by the square of the CIC window (assignment and interpolation) to deconvolve it.
+    """
+    size = 2 * n_mesh
+    d = np.arange(size, dtype=np.float64)
+    d = np.minimum(d, size - d) # distance in cells, offsets n..2n-1 standing for -n..-1
+    r = np.sqrt(d[:, None, None]**2 + d[None, :, None]**2 + d[None, None, :]**2)
+    r[0, 0, 0] = 1.0
+    if split > 0.0:
+        kernel = -np.vectorize(math.erf)(r / (2.0 * split)) / r
+        kernel[0, 0, 0] = -1.0 / (split * np.sqrt(np.pi))
+    else:
+        kernel = -1.0 / r
+        kernel[0, 0, 0] = -CELL_SELF_POTENTIAL
+    green = np.fft.rfftn(kernel)
+
+    if split > 0.0:
+        sx = np.sinc(np.fft.fftfreq(size))**2 # np.sinc(x) = sin(pi x) / (pi x)
+        sz = np.sinc(np.fft.rfftfreq(size))**2
+        window = sx[:, None, None] * sx[None, :, None] * sz[None, None, :]
+        green /= window**2
+    return green
+
+
+def mesh_size(n_mesh):
+    """
+    n_mesh as an int, checked to leave room for the stars inside the 3 empty cells kept on each side.
+    """
+    n_mesh = int(n_mesh)
+    if n_mesh <= 6:
+        raise ValueError(f"the mesh needs more than 6 cells per side, not n_mesh={n_mesh}")
+    return n_mesh
+
+
+def mesh_geometry(positions, n_mesh):
+    """
+    Origin and cell size h of a cubic mesh of n_mesh^3 cells centered on the stars, keeping 3 empty cells
+    on each side for the CIC stencil and the finite differences.
+    The mesh is at least MIN_EXTENT wide: the mesh force scales as G m / h^2, so a vanishing h would turn
+    rounding errors of the (zero) self-force into huge accelerations.
+    """
+    low = positions.min(axis=0)
+    high = positions.max(axis=0)
+    h = max(float(np.max(high - low)), MIN_EXTENT) / (n_mesh - 6)
+    origin = (low + high) / 2.0 - h * n_mesh / 2.0
+    return origin, h
+
+
+def cic_weights(positions, origin, h):
+    """
+    Lower cell index (N, 3) and fraction (N, 3) of every star along each axis, cell centers being at (i + 0.5) h.
+    """
+    u = (positions - origin) / h - 0.5
+    index = np.floor(u).astype(np.int64)
+    return index, u - index
+
+
+def cic_deposit(index, fraction, mass, n_mesh):
+    """
+    Mass of every cell of the n_mesh^3 mesh, each star being spread over its 8 nearest cells.
+    """
+    density = np.zeros(n_mesh**3, dtype=np.float64)
+    for corner in range(8):
+        ox, oy, oz = corner >> 2 & 1, corner >> 1 & 1, corner & 1
+        weight = mass.copy()
+        for axis, o in enumerate((ox, oy, oz)):
+            weight *= fraction[:, axis] if o else 1.0 - fraction[:, axis]
+        cell = ((index[:, 0] + ox) * n_mesh + index[:, 1] + oy) * n_mesh + index[:, 2] + oz
+        density += np.bincount(cell, weights=weight, minlength=n_mesh**3)
+    return density.reshape(n_mesh, n_mesh, n_mesh)
+
+
+def cic_interpolate(field, index, fraction):
+    """
+    Value of a mesh field at every star, with the same weights as cic_deposit.
+    """
+    values = np.zeros(index.shape[0], dtype=np.float64)
+    for corner in range(8):
+        ox, oy, oz = corner >> 2 & 1, corner >> 1 & 1, corner & 1
+        weight = np.ones(index.shape[0], dtype=np.float64)
+        for axis, o in enumerate((ox, oy, oz)):
+            weight *= fraction[:, axis] if o else 1.0 - fraction[:, axis]
+        values += weight * field[index[:, 0] + ox, index[:, 1] + oy, index[:, 2] + oz]
+    return values
+
+
+def difference(potential, axis):
+    """
+    4-point centered derivative of the potential along axis, in units of cells (zero on the 2 border cells).
+    """
+    n = potential.shape[axis]
+    def part(start, stop):
+        return potential.take(np.arange(start, n + stop), axis=axis)
+    derivative = np.zeros_like(potential)
+    inner = [slice(None)] * 3
+    inner[axis] = slice(2, n - 2)
+    derivative[tuple(inner)] = (8.0 * (part(3, -1) - part(1, -3)) - (part(4, 0) - part(0, -4))) / 12.0
+    return derivative
+
+
+def mesh_acceleration(positions, mass, n_mesh=64, split=0.0):
+    """
+    Accelerations (N, 3) given by the mesh (the long-range part only if split > 0), with the mesh geometry.
+    """
+    origin, h = mesh_geometry(positions, n_mesh)
+    index, fraction = cic_weights(positions, origin, h)
+    density = cic_deposit(index, fraction, mass, n_mesh)
+
+    size = 2 * n_mesh
+    potential = np.fft.irfftn(np.fft.rfftn(density, s=(size, size, size)) * green_function(n_mesh, split),
+                              s=(size, size, size))[:n_mesh, :n_mesh, :n_mesh]
+    potential *= G / h
+
+    accelerations = np.empty_like(positions)
+    for axis in range(3):
+        accelerations[:, axis] = -cic_interpolate(difference(potential, axis), index, fraction) / h
+    return accelerations
+
+
+@numba.njit("(f8[:, ::1], f8[::1], f8)", cache=True, nogil=True)
+def neighbor_grid(positions, origin, cell):
+    """
+    Organize stars into a 3D grid of cells of size cell with Compressed Sparse Row (CSR) logic, as
+    grid_matrice_crs does in 2D : beg_cases holds the offsets of each cell in tab, which lists the star
+    IDs sorted by cell. Also returns the number of cells along each axis.
+    """
+    n = positions.shape[0]
+    dims = np.ones(3, dtype=numba.int64)
+    for axis in range(3):
+        extent = 0.0
+        for i in range(n):
+            extent = max(extent, positions[i, axis] - origin[axis])
+        dims[axis] = int(extent / cell) + 1
+
+    place = np.empty(n, dtype=numba.int64)
+    aux = np.zeros(dims[0] * dims[1] * dims[2], dtype=numba.int64)
+    for i in range(n):
+        cx = int((positions[i, 0] - origin[0]) / cell)
+        cy = int((positions[i, 1] - origin[1]) / cell)
+        cz = int((positions[i, 2] - origin[2]) / cell)
+        place[i] = (cx * dims[1] + cy) * dims[2] + cz
+        aux[place[i]] += 1
+
+    beg_cases = np.zeros(aux.shape[0] + 1, dtype=numba.int64)
+    beg_cases[1:] = np.cumsum(aux)
+    aux[:] = 0
+    tab = np.zeros(n, dtype=numba.int64)
+    for i in range(n):
+        tab[beg_cases[place[i]] + aux[place[i]]] = i
+        aux[place[i]] += 1
+
+    return beg_cases, tab, dims
+
+
+@lru_cache(maxsize=None)
+def short_range_table():
+    """
+    Short-range factor erfc(u) + 2u / sqrt(pi) exp(-u^2), with u = r / 2rs, tabulated at u^2 = k / SHORT_RANGE_POINTS
+    (the factor is below 1e-9 beyond u^2 = SHORT_RANGE_EXTENT).
+    """
+    u = np.sqrt(np.arange(SHORT_RANGE_EXTENT * SHORT_RANGE_POINTS + 2) / SHORT_RANGE_POINTS)
+    return np.array([math.erfc(x) + 2.0 * x / np.sqrt(np.pi) * np.exp(-x * x) for x in u])
+
+
+@numba.njit("(f8[:, ::1], f8[::1], f8[::1], i8[::1], i8[::1], i8[::1], f8, f8, f8[::1], i8)",
+            parallel=True, cache=True, nogil=True)
+def short_range_acceleration(positions, mass, origin, beg_cases, tab, dims, cell, split, table, table_size):
+    """
+    Short-range part of the P3M force, G m_j d / r^3 (erfc(r / 2rs) + r / (rs sqrt(pi)) exp(-r^2 / 4rs^2)),
+    summed over the stars closer than the cutoff (the size of a neighbor grid cell), rs being split.
+    The factor is interpolated in short_range_table (table_size points per unit of u^2).
+    The stars are copied in tab order, so that the stars of neighboring cells are read contiguously.
+    """
+    n = positions.shape[0]
+    sorted_positions = np.empty((n, 3), dtype=np.float64)
+    sorted_mass = np.empty(n, dtype=np.float64)
+    for k in range(n):
+        sorted_positions[k] = positions[tab[k]]
+        sorted_mass[k] = mass[tab[k]]
+
+    accelerations = np.zeros((n, 3), dtype=np.float64)
+    cutoff2 = cell * cell
+    scale = table_size / (4.0 * split * split) # u^2 = r^2 / 4rs^2, in table points
+    last = table.shape[0] - 2
+    n_cells = dims[0] * dims[1] * dims[2]
+
+    for place_i in numba.prange(n_cells):
+        cx = place_i // (dims[1] * dims[2])
+        cy = place_i // dims[2] % dims[1]
+        cz = place_i % dims[2]
+        for k in range(beg_cases[place_i], beg_cases[place_i + 1]):
+            px, py, pz = sorted_positions[k, 0], sorted_positions[k, 1], sorted_positions[k, 2]
+            ax, ay, az = 0.0, 0.0, 0.0
+            for x in range(max(cx - 1, 0), min(cx + 2, dims[0])):
+                for y in range(max(cy - 1, 0), min(cy + 2, dims[1])):
+                    for z in range(max(cz - 1, 0), min(cz + 2, dims[2])):
+                        place = (x * dims[1] + y) * dims[2] + z
+                        for j in range(beg_cases[place], beg_cases[place + 1]):
+                            dx = sorted_positions[j, 0] - px
+                            dy = sorted_positions[j, 1] - py
+                            dz = sorted_positions[j, 2] - pz
+                            dist2 = dx*dx + dy*dy + dz*dz
+                            if dist2 > cutoff2 or dist2 < 1e-20: # also skips j == k
+                                continue
+                            t = dist2 * scale
+                            if t >= last:
+                                continue
+                            q = int(t)
+                            t -= q
+                            f = G * sorted_mass[j] / (dist2 * np.sqrt(dist2)) * ((1.0 - t) * table[q] + t * table[q + 1])
+                            ax += f * dx
+                            ay += f * dy
+                            az += f * dz
+            i = tab[k]
+            accelerations[i, 0] = ax
+            accelerations[i, 1] = ay
+            accelerations[i, 2] = az
+
+    return accelerations
+
+
+def calculate_acceleration(positions, mass, n_mesh=64, p3m=False, split=1.25, cutoff=4.5):
+    """
+    Compute gravitational acceleration with the particle-mesh method on an n_mesh^3 mesh.
+    With p3m, the mesh carries the long-range force only, smoothed at split cells, and the pairs closer
+    than cutoff * split cells are summed directly with the short-range force (P3M).
+    """
+    positions = np.require(positions, np.float64, ["C", "W"]) # the kernels only take C-contiguous float64 arrays
+    mass = np.require(mass, np.float64, ["C", "W"])
+    n_mesh = mesh_size(n_mesh)
+    if positions.shape[0] < 2: # no pair, no force
+        return np.zeros_like(positions)
+    if not p3m:
+        return mesh_acceleration(positions, mass, n_mesh)
+
+    accelerations = mesh_acceleration(positions, mass, n_mesh, split)
+    origin, h = mesh_geometry(positions, n_mesh)
+    cell = cutoff * split * h
+    beg_cases, tab, dims = neighbor_grid(positions, origin, cell)
+    accelerations += short_range_acceleration(positions, mass, origin, beg_cases, tab, dims, cell, split * h,
+                                              short_range_table(), SHORT_RANGE_POINTS)
+    return accelerations
+
+
+def step(dt):
+    """
+    Updates the all the positions in the system after a time step dt using the Verlet integration method.
+    The integrator keeps the end-of-step acceleration, so each step needs one force evaluation.
+    """
+    global integrator
+    return integrator.step(dt)
+
+
+if __name__ == "__main__":
+    global positions, velocity, mass, color, integrator
+
+    galaxy_file = "data/galaxy_{}".format(sys.argv[2] if len(sys.argv) > 2 else "100")
+    positions, velocity, mass, color = load_galaxy(galaxy_file)
+
+    dt = float(sys.argv[1]) if len(sys.argv) > 1 else 1e-3
+    n_mesh = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+
+    integrator = VelocityVerlet(positions, velocity, lambda pos: calculate_acceleration(pos, mass, n_mesh, p3m=True))
+    positions = integrator.positions
+
+    # Time the execution of 10 steps
+    start_time = time.time()
+    for _ in range(10):
+        step(dt)
+    end_time = time.time()
+    print(f"Time for 10 steps ({len(mass)} bodies): {end_time - start_time:.4f} seconds\n")
+
+    # Visualization
+    luminosities = np.ones(len(positions), dtype=np.float32)
+    bounds = ((-3, 3), (-3, 3), (-3, 3))
+
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
+    visualizer = Visualizer3D(positions, color, luminosities, bounds)
+    visualizer.run(updater=step, dt=dt)
@@ -1,28 +1,13 @@
 import numpy as np
+import os
+import threading
 import time
-from galaxy_generator import generate_star_color
-from visualizer3d_vbo import Visualizer3D
+from concurrent.futures import ThreadPoolExecutor
+from galaxy.loader import load_galaxy
 import sys
 
 G = 1.560339e-13 # Gravitationnal constant
 
-def load_galaxy(filename):
-    """
-    Load a system of bodies from a file like (mass, positionx, positiony, positionz, velocityx, velocityy, velocityz)
-    """
-    position = [] # [[0, 0, 0], [0, 0, 0], ...]
-    velocity = [] # [[0, 0, 0], [0, 0, 0], ...]
-    color = []  # [(255, 255, 255), (255, 255, 255), ...]
-    mass = [] # [1.0, 1.0, ...]
-
-    with open(filename, 'r') as file:
-        for line in file:
-            data = list(map(float, line.split()))
-            position.append(data[1:4])
-            velocity.append(data[4:7])
-            color.append(generate_star_color(data[0]))
-            mass.append(data[0])
-    return np.array(position), np.array(velocity), np.array(mass), np.array(color)
 
 def calculate_acceleration(position, mass):
     """
@@ -39,6 +24,122 @@ def calculate_acceleration(position, mass):
 
     return total_acc
 
+def tile_buffers(block_size):
+    """
+    Scratch buffers of one block_size x block_size tile: dx, dy, dz, dist^2, a temporary, the gravitational
+    factor and the mask of the pairs taken into account.
+    """
+    buffers = [np.empty((block_size, block_size)) for _ in range(6)]
+    return buffers + [np.empty((block_size, block_size), dtype=bool)]
+
+
+def accelerate_rows(x, y, z, gm, i0, i1, acc, buffers, block_size):
+    """
+    Compute into acc the accelerations of the bodies i0 to i1 (one i-block) due to all bodies,
+    looping over the j-blocks with the scratch buffers of tile_buffers(block_size).
+    """
+    n = x.shape[0]
+    dx, dy, dz, dist2, tmp, factor, mask = buffers
+    acc[:] = 0.0
+    xi, yi, zi = x[i0:i1, np.newaxis], y[i0:i1, np.newaxis], z[i0:i1, np.newaxis]
+
+    for j0 in range(0, n, block_size):
+        j1 = min(n, j0 + block_size)
+        h, w = i1 - i0, j1 - j0
+        DX, DY, DZ = dx[:h, :w], dy[:h, :w], dz[:h, :w]
+        R2, T, F, M = dist2[:h, :w], tmp[:h, :w], factor[:h, :w], mask[:h, :w]
+
+        np.subtract(x[j0:j1], xi, out=DX) # DX[i,j] = x[j] - x[i]
+        np.subtract(y[j0:j1], yi, out=DY)
+        np.subtract(z[j0:j1], zi, out=DZ)
+
+        np.multiply(DX, DX, out=R2)
+        np.multiply(DY, DY, out=T)
+        np.add(R2, T, out=R2)
+        np.multiply(DZ, DZ, out=T)
+        np.add(R2, T, out=R2) # R2 = dist^2
+
+        np.sqrt(R2, out=T)
+        np.multiply(T, R2, out=T) # T = dist^3
+        np.greater(R2, 1e-20, out=M) # avoid i == j case and too close bodies (dist > 1e-10)
+        F.fill(0.0)
+        np.divide(gm[j0:j1], T, out=F, where=M) # G * m_j / r_ij^3
+
+        acc[:, 0] += np.einsum("ij,ij->i", F, DX)
+        acc[:, 1] += np.einsum("ij,ij->i", F, DY)
+        acc[:, 2] += np.einsum("ij,ij->i", F, DZ)
+
+
+def calculate_acceleration_blocked(position, mass, block_size=128, out=None):
+    """
+    Same result as calculate_acceleration, evaluated by tiles of block_size x block_size pairs (i-block x j-block).
+    The tile temporaries are allocated once and reused through ufunc out= arguments, so the memory used
+    is O(N + block_size^2) instead of O(N^2) and each tile stays in cache.
+    If out is given (shape (N, 3)), the accelerations are written into it.
+    """
+    n = position.shape[0]
+    if out is None:
+        out = np.empty((n, 3))
+
+    x, y, z = (np.ascontiguousarray(position[:, k]) for k in range(3))
+    gm = G * mass
+    buffers = tile_buffers(block_size) # reused for every (i-block, j-block) pair
+
+    for i0 in range(0, n, block_size):
+        i1 = min(n, i0 + block_size)
+        accelerate_rows(x, y, z, gm, i0, i1, out[i0:i1], buffers, block_size)
+
+    return out
+
+
+class ThreadedAcceleration:
+    """
+    Multithreaded version of calculate_acceleration_blocked: the i-blocks (rows of the acceleration array)
+    are evaluated in parallel by a ThreadPoolExecutor. The large NumPy ufunc calls of each tile release
+    the GIL, so the threads run on several cores without numba.
+    Each worker thread keeps its own tile scratch buffers, allocated once and reused across steps.
+
+    Usage:
+        accel = ThreadedAcceleration(mass, workers=8)
+        acc = accel(position)
+    """
+
+    def __init__(self, mass, workers=None, block_size=128):
+        """
+        workers is the number of threads (os.cpu_count() by default).
+        """
+        self.gm = G * np.asarray(mass)
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.local = threading.local()
+
+    def _buffers(self):
+        if not hasattr(self.local, "buffers"):
+            self.local.buffers = tile_buffers(self.block_size)
+        return self.local.buffers
+
+    def _rows(self, x, y, z, i0, i1, out):
+        accelerate_rows(x, y, z, self.gm, i0, i1, out[i0:i1], self._buffers(), self.block_size)
+
+    def __call__(self, position, out=None):
+        n = position.shape[0]
+        if out is None:
+            out = np.empty((n, 3))
+        x, y, z = (np.ascontiguousarray(position[:, k]) for k in range(3))
+
+        futures = [self.executor.submit(self._rows, x, y, z, i0, min(n, i0 + self.block_size), out)
+                   for i0 in range(0, n, self.block_size)]
+        for future in futures:
+            future.result() # re-raises the exception of a failed block
+        return out
+
+    def close(self):
+        """
+        Stop the worker threads.
+        """
+        self.executor.shutdown()
+
 def update(acceleration, velocity, position, dt):
     """
     Updates position and velocity using the provided formulas:
@@ -81,5 +182,6 @@ if __name__ == "__main__":
     luminosities = np.ones(len(position), dtype=np.float32)
     bounds = ((-3, 3), (-3, 3), (-3, 3))
 
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
     visualizer = Visualizer3D(position, color, luminosities, bounds)
     visualizer.run(updater=step, dt=dt)
\ No newline at end of file
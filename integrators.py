@@ -0,0 +1,219 @@
+import numpy as np
+
+
+class VelocityVerlet:
+    """
+    Velocity Verlet integrator in its kick-drift-kick form.
+    v(t+dt/2) = v(t) + dt/2 * a(t)
+    p(t+dt)   = p(t) + dt * v(t+dt/2)
+    v(t+dt)   = v(t+dt/2) + dt/2 * a(t+dt)
+
+    The acceleration at the end of a step is kept for the first kick of the next one,
+    so each step costs a single force evaluation.
+    """
+
+    def __init__(self, positions, velocities, accel_func):
+        """
+        accel_func(positions) must return the (N, 3) array of accelerations.
+        """
+        self.positions = np.array(positions, dtype=np.float64)
+        self.velocities = np.array(velocities, dtype=np.float64)
+        self.accel_func = accel_func
+        self.acceleration = None # computed at the first step, then carried from step to step
+
+    def invalidate(self):
+        """
+        Drop the cached acceleration, to be called when positions are modified outside of step.
+        """
+        self.acceleration = None
+
+    def step(self, dt):
+        """
+        Advance positions and velocities by dt and return the new positions.
+        """
+        if self.acceleration is None:
+            self.acceleration = self.accel_func(self.positions)
+
+        self.velocities += 0.5 * dt * self.acceleration # kick
+        self.positions += dt * self.velocities # drift
+        self.acceleration = self.accel_func(self.positions)
+        self.velocities += 0.5 * dt * self.acceleration # kick
+        return self.positions
+
+
+class Euler:
+    """
+    Explicit Euler update used by the first versions of the simulation.
+    p(t+dt) = p(t) + dt*v(t) + 0.5 * dt^2 * a(t)
+    v(t+dt) = v(t) + dt * a(t)
+    """
+
+    def __init__(self, positions, velocities, accel_func):
+        """
+        accel_func(positions) must return the (N, 3) array of accelerations.
+        """
+        self.positions = np.array(positions, dtype=np.float64)
+        self.velocities = np.array(velocities, dtype=np.float64)
+        self.accel_func = accel_func
+
+    def step(self, dt):
+        """
+        Advance positions and velocities by dt and return the new positions.
+        """
+        acc = self.accel_func(self.positions)
+        self.positions += self.velocities * dt + 0.5 * acc * dt**2
+        self.velocities += acc * dt
+        return self.positions
+
+
+class RK4:
+    """
+    Classical Runge-Kutta integrator of order 4, four force evaluations per step.
+    """
+
+    def __init__(self, positions, velocities, accel_func):
+        """
+        accel_func(positions) must return the (N, 3) array of accelerations.
+        """
+        self.positions = np.array(positions, dtype=np.float64)
+        self.velocities = np.array(velocities, dtype=np.float64)
+        self.accel_func = accel_func
+
+    def step(self, dt):
+        """
+        Advance positions and velocities by dt and return the new positions.
+        """
+        p1, v1 = self.positions, self.velocities
+        a1 = self.accel_func(p1)
+
+        v2 = v1 + 0.5 * a1 * dt
+        a2 = self.accel_func(p1 + 0.5 * v1 * dt)
+
+        v3 = v1 + 0.5 * a2 * dt
+        a3 = self.accel_func(p1 + 0.5 * v2 * dt)
+
+        v4 = v1 + a3 * dt
+        a4 = self.accel_func(p1 + v3 * dt)
+
+        self.positions += (dt / 6) * (v1 + 2*v2 + 2*v3 + v4)
+        self.velocities += (dt / 6) * (a1 + 2*a2 + 2*a3 + a4)
+        return self.positions
+
+
+class BlockTimeStep:
+    """
+    Kick-drift-kick integrator with individual power-of-two time steps (hierarchical block time steps).
+
+    A call to step(dt) advances every body by dt, but body i does it in 2^level[i] steps of dt / 2^level[i].
+    The level of a body is chosen from its time scale
+        tau_i = min(|v_i| / |a_i|, |a_i| / |jerk_i|)
+    (|v| / |a| is the orbital period / 2 pi of a circular orbit, the jerk is estimated from the accelerations
+    at the start and end of the last step of the body), as the smallest level with dt / 2^level <= eta * tau_i.
+    A body whose acceleration is below quiet times the median acceleration (a central black hole, nearly at
+    rest and only pulled by the recoil of its stars) stays on level 0: |v| / |a| vanishes for it, but its
+    velocity changes by less than dt * |a| over a step, much less than for a typical star.
+
+    Time is counted in ticks of dt / 2^max_level. At each tick where some steps end, all bodies are drifted
+    to that time, the accelerations of the bodies ending a step (the active ones) are computed, then they
+    get their closing half kick, a new level and the opening half kick of their next step. A body can only
+    move to a longer step at a tick where that longer step starts, so that the steps stay nested and all
+    bodies are synchronized at the end of step(dt). If every body stays on level 0 this is VelocityVerlet.
+
+    Forces are computed for the active bodies only, with the subset(positions, active) function of accel_func
+    (see galaxy/registry.py). Without one, each tick would cost a full force evaluation, so every body stays
+    on level 0 and the integrator is VelocityVerlet.
+    """
+
+    def __init__(self, positions, velocities, accel_func, eta=0.05, max_level=8, quiet=1e-3):
+        """
+        accel_func(positions) must return the (N, 3) array of accelerations.
+        """
+        self.positions = np.array(positions, dtype=np.float64)
+        self.velocities = np.array(velocities, dtype=np.float64)
+        self.accel_func = accel_func
+        self.eta = eta
+        self.max_level = max_level if getattr(accel_func, "subset", None) is not None else 0
+        self.quiet = quiet
+        self.typical_acceleration = None # median |a|, updated at each step
+        self.acceleration = None # computed at the first step, then carried from step to step
+        self.levels = None # levels of the next step, carried with the acceleration
+        self.force_count = 0 # number of accelerations computed (one per active body)
+
+    def invalidate(self):
+        """
+        Drop the cached acceleration and levels, to be called when positions are modified outside of step.
+        """
+        self.acceleration = None
+        self.levels = None
+
+    def _accelerations(self, active):
+        self.force_count += len(active)
+        if self.max_level == 0: # no subset function
+            return self.accel_func(self.positions)[active]
+        return self.accel_func.subset(self.positions, active)
+
+    def choose_levels(self, dt, velocities, acceleration, jerk=None):
+        """
+        Levels (between 0 and max_level) whose time steps dt / 2^level resolve the time scale of each body.
+        """
+        if self.max_level == 0:
+            return np.zeros(len(acceleration), dtype=np.int64)
+        a = np.linalg.norm(acceleration, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tau = np.linalg.norm(velocities, axis=1) / a
+            if jerk is not None:
+                tau = np.fmin(tau, a / np.linalg.norm(jerk, axis=1))
+            levels = np.ceil(np.log2(dt / (self.eta * tau)))
+        levels = np.nan_to_num(levels, nan=0.0, posinf=self.max_level, neginf=0.0)
+        levels[a < self.quiet * self.typical_acceleration] = 0
+        return np.clip(levels, 0, self.max_level).astype(np.int64)
+
+    def step(self, dt):
+        """
+        Advance positions and velocities by dt and return the new positions.
+        """
+        if self.acceleration is None:
+            self.acceleration = self._accelerations(np.arange(len(self.positions)))
+        self.typical_acceleration = np.median(np.linalg.norm(self.acceleration, axis=1))
+        if self.levels is None:
+            self.levels = self.choose_levels(dt, self.velocities, self.acceleration)
+
+        ticks = 1 << self.max_level
+        tick_dt = dt / ticks
+        length = ticks >> self.levels # step length of each body in ticks
+        end = length.copy() # tick at which the current step of each body ends
+        self.velocities += (0.5 * tick_dt * length)[:, np.newaxis] * self.acceleration # opening kicks
+        now = 0
+
+        while now < ticks:
+            next_tick = int(end.min())
+            self.positions += ((next_tick - now) * tick_dt) * self.velocities # drift
+            now = next_tick
+            active = np.flatnonzero(end == now)
+
+            acceleration = self._accelerations(active)
+            step_dt = (tick_dt * length[active])[:, np.newaxis]
+            self.velocities[active] += 0.5 * step_dt * acceleration # closing kicks
+            jerk = (acceleration - self.acceleration[active]) / step_dt
+            self.acceleration[active] = acceleration
+
+            # New levels, kept on a longer step only if it starts now
+            levels = self.choose_levels(dt, self.velocities[active], acceleration, jerk)
+            levels = np.maximum(levels, self.max_level - _trailing_zeros(now, self.max_level))
+            self.levels[active] = levels
+            length[active] = ticks >> levels
+            end[active] = now + length[active]
+            if now < ticks:
+                self.velocities[active] += (0.5 * tick_dt * length[active])[:, np.newaxis] * acceleration # opening kicks
+
+        return self.positions
+
+
+def _trailing_zeros(tick, max_level):
+    """
+    Number of trailing zero bits of tick (max_level for tick 0): the longest steps starting at tick last
+    2^that ticks.
+    """
+    if tick == 0:
+        return max_level
+    return (tick & -tick).bit_length() - 1
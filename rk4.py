@@ -1,10 +1,16 @@
 import numpy as np
 import time
 from galaxy_generator import generate_star_color
-from visualizer3d_vbo import Visualizer3D
+from galaxy.loader import load_galaxy as read_galaxy
 import sys
+import numba
 
 G = 1.560339e-13 # Gravitationnal constant
+
+# Kernels compiled at import for C-contiguous float64 arrays, then loaded from the numba disk cache.
+# They release the GIL (nogil), so that they can run in the simulation thread of galaxy/pipeline.py.
+
+
 class Body:
     def __init__(self, mass, position, velocity):
         self.mass = mass
@@ -28,6 +34,126 @@ class Body:
         self.position += self.velocity * dt + 0.5 * acceleration * dt**2
         self.velocity += acceleration * dt
     
+@numba.njit("(f8[:, ::1], f8[::1], f8[:, ::1])", parallel=True, cache=True, nogil=True)
+def acceleration_kernel(positions, masses, out):
+    """
+    Calculate the gravitational accelerations on each body due to all other bodies, written into out.
+    """
+    n = positions.shape[0]
+    for i in numba.prange(n):
+        ax, ay, az = 0.0, 0.0, 0.0
+        for j in range(n):
+            if i == j:
+                continue
+            dx = positions[j, 0] - positions[i, 0]
+            dy = positions[j, 1] - positions[i, 1]
+            dz = positions[j, 2] - positions[i, 2]
+            dist = np.sqrt(dx*dx + dy*dy + dz*dz)
+            if dist > 1e-10: # Avoid division by zero for very close bodies
+                f = G * masses[j] / (dist**3)
+                ax += f * dx
+                ay += f * dy
+                az += f * dz
+        out[i, 0] = ax
+        out[i, 1] = ay
+        out[i, 2] = az
+    return out
+
+
+@numba.njit("(f8[:, ::1], f8[:, ::1], f8, f8[:, ::1])", parallel=True, cache=True, nogil=True)
+def rk4_stage(out, base, h, slope):
+    """
+    Intermediate RK4 state, written into out: out = base + h * slope
+    """
+    for i in numba.prange(base.shape[0]):
+        for k in range(3):
+            out[i, k] = base[i, k] + h * slope[i, k]
+
+
+@numba.njit("(f8[:, ::1], f8[:, ::1], f8[:, ::1], f8[:, ::1], f8[:, ::1], f8[:, ::1], f8[:, ::1], f8[:, ::1], f8[:, ::1], f8)",
+            parallel=True, cache=True, nogil=True)
+def rk4_update(positions, velocities, v2, v3, v4, a1, a2, a3, a4, dt):
+    """
+    Final RK4 combination, in place:
+    p += dt/6 * (v1 + 2*v2 + 2*v3 + v4)
+    v += dt/6 * (a1 + 2*a2 + 2*a3 + a4)
+    """
+    h = dt / 6
+    for i in numba.prange(positions.shape[0]):
+        for k in range(3):
+            positions[i, k] += h * (velocities[i, k] + 2*v2[i, k] + 2*v3[i, k] + v4[i, k])
+            velocities[i, k] += h * (a1[i, k] + 2*a2[i, k] + 2*a3[i, k] + a4[i, k])
+
+
+def rk4_step(positions, velocities, accelerate, buffers, dt):
+    """
+    Advance positions and velocities by dt in place with the classical RK4 scheme.
+    accelerate(positions, out) returns the accelerations, written into out if it can (otherwise in a new array,
+    used as is); buffers is an RK4Buffers.
+    """
+    p1, v1, p = positions, velocities, buffers.stage_position
+
+    # step 1
+    a1 = accelerate(p1, buffers.a1)
+
+    # step 2
+    rk4_stage(buffers.v2, v1, 0.5 * dt, a1)
+    rk4_stage(p, p1, 0.5 * dt, v1)
+    a2 = accelerate(p, buffers.a2)
+
+    # step 3
+    rk4_stage(buffers.v3, v1, 0.5 * dt, a2)
+    rk4_stage(p, p1, 0.5 * dt, buffers.v2)
+    a3 = accelerate(p, buffers.a3)
+
+    # step 4
+    rk4_stage(buffers.v4, v1, dt, a3)
+    rk4_stage(p, p1, dt, buffers.v3)
+    a4 = accelerate(p, buffers.a4)
+
+    # update position and velocity
+    rk4_update(p1, v1, buffers.v2, buffers.v3, buffers.v4, a1, a2, a3, a4, dt)
+
+
+class RK4Buffers:
+    """
+    RK4 stage buffers, allocated once and reused at every step.
+    """
+
+    def __init__(self, shape):
+        self.stage_position = np.empty(shape)
+        self.v2, self.v3, self.v4 = np.empty(shape), np.empty(shape), np.empty(shape)
+        self.a1, self.a2, self.a3, self.a4 = np.empty(shape), np.empty(shape), np.empty(shape), np.empty(shape)
+
+
+class BufferedRK4:
+    """
+    Classical RK4 integrator for any force backend, with the stage buffers and numba stage kernels of NBodies.
+    Registered as the "rk4-numba" integrator (the generic integrators.RK4 allocates its stages at every step).
+    The intermediate positions and velocities are preallocated; the accelerations are the arrays returned by
+    the backend, used without copy (a backend's accel(positions) allocates its result).
+    """
+
+    def __init__(self, positions, velocities, accel_func):
+        """
+        accel_func(positions) must return the (N, 3) array of accelerations.
+        """
+        self.positions = np.array(positions, dtype=np.float64)
+        self.velocities = np.array(velocities, dtype=np.float64)
+        self.accel_func = accel_func
+        self.buffers = RK4Buffers(self.positions.shape)
+
+    def _accelerate(self, positions, out):
+        return np.require(self.accel_func(positions), np.float64, ["C", "W"]) # out is only for acceleration_kernel
+
+    def step(self, dt):
+        """
+        Advance positions and velocities by dt and return the new positions.
+        """
+        rk4_step(self.positions, self.velocities, self._accelerate, self.buffers, dt)
+        return self.positions
+
+
 class NBodies:
 
     def __init__(self, bodies_list):
@@ -38,77 +164,37 @@ class NBodies:
         self.positions = np.array([body.position for body in bodies_list], dtype=np.float64)
         self.velocities = np.array([body.velocity for body in bodies_list], dtype=np.float64)
         self.masses = np.array([body.mass for body in bodies_list], dtype=np.float64)
+        self.buffers = RK4Buffers(self.positions.shape)
 
-    def calculate_acceleration(self, positions, masses):
+    def calculate_acceleration(self, positions, masses, out=None):
         """
         Calculate the gravitational accelerations on each body due to all other bodies.
         """
-        num_bodies = len(masses)
-        accelerations = np.zeros((num_bodies, 3))
-
-        for i in range(num_bodies):
-            diff = positions - positions[i]
-
-            diff[i] = 0
-            dist = np.linalg.norm(diff, axis=1)
-            mask = dist > 1e-10 # Avoid division by zero for very close bodies
-            accel_components = G * (masses[mask]/(dist[mask]**3))[:, np.newaxis] * diff[mask]
-            accelerations[i] = np.sum(accel_components, axis=0)
-                
-        return accelerations
-    
+        if out is None:
+            out = np.empty_like(positions)
+        return acceleration_kernel(positions, masses, out)
+
     def update_position(self, dt):
-        # step 1
-        v1 = self.velocities
-        p1 = self.positions
-        a1 = self.calculate_acceleration(p1, self.masses)
-
-        # step 2
-        v2 = v1 + 0.5 * a1 * dt
-        p2 = p1 + 0.5 * v1 * dt
-        a2 = self.calculate_acceleration(p2, self.masses)
-
-        # step 3
-        v3 = v1 + 0.5 * a2 * dt
-        p3 = p1 + 0.5 * v2 * dt
-        a3 = self.calculate_acceleration(p3, self.masses)
-
-        # step 4
-        v4 = v1 + a3 * dt
-        p4 = p1 + v3 * dt
-        a4 = self.calculate_acceleration(p4, self.masses)
-
-        # update position and velocity
-        self.positions += (dt / 6) * (v1 + 2*v2 + 2*v3 + v4)
-        self.velocities += (dt / 6) * (a1 + 2*a2 + 2*a3 + a4)
+        rk4_step(self.positions, self.velocities, lambda positions, out: acceleration_kernel(positions, self.masses, out),
+                 self.buffers, dt)
 
     def step(self, dt):
         """
         Performs one complete simulation step.
         """
-        global system
-        system.update_position(dt)
-        return system.positions
+        self.update_position(dt)
+        return self.positions
 
 def load_galaxy(filename):
         """
         Load a system of bodies from a file like (mass, positionx, positiony, positionz, speedx, speedy, speedz)
         """
-        bodies = []
-        with open(filename, 'r') as file:
-            for line in file:
-                data = list(map(float, line.split()))
-                mass = data[0]
-                position = data[1:4]
-                speed = data[4:7]
-                body = Body(mass, position, speed)
-                bodies.append(body)
-        return bodies
+        positions, speeds, masses, colors = read_galaxy(filename)
+        return [Body(mass, position, speed) for mass, position, speed in zip(masses, positions, speeds)]
 
 if __name__ == "__main__":
 
     galaxy = load_galaxy("data/galaxy_{}".format(sys.argv[2] if len(sys.argv) > 2 else "100"))
-    global system
     system = NBodies(galaxy)
 
     if system:
@@ -130,5 +216,6 @@ if __name__ == "__main__":
     luminosities = np.ones(len(system.collection), dtype=np.float32)
     bounds = ((-3, 3), (-3, 3), (-3, 3))
 
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
     visualizer = Visualizer3D(points, colors, luminosities, bounds)
     visualizer.run(updater=system.step, dt=dt)
\ No newline at end of file
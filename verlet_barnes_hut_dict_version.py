@@ -1,8 +1,7 @@
 import numpy as np
-from scipy.spatial import distance
 import time
-from galaxy_generator import generate_star_color
-from visualizer3d_vbo import Visualizer3D
+from galaxy.loader import load_galaxy
+from integrators import VelocityVerlet
 import sys
 
 G = 1.560339e-13  # Gravitationnal constant
@@ -102,42 +101,20 @@ def calculate_acceleration(positions, mass):
 def step(dt):
     """
     Update the positions and velocities of all stars using the Verlet integration method.
+    The integrator keeps the end-of-step acceleration, so each step needs one force evaluation.
     """
-    global positions, velocity, mass
-    acc = calculate_acceleration(positions, mass)
-
-    new_positions = positions + velocity * dt + 0.5 * acc * dt**2
-    new_acc = calculate_acceleration(new_positions, mass)
-    new_velocity = velocity + 0.5 * (acc + new_acc) * dt
-
-    positions = new_positions
-    velocity = new_velocity
-    return positions
-
-
-def load_galaxy(filename):
-    """
-    Load a system of stars from a file like (mass, positionx, positiony, positionz, velocityx, velocityy, velocityz)
-    """
-    positions, velocity, color, mass = [], [], [], []
-
-    with open(filename, 'r') as file:
-        for line in file:
-            data = list(map(float, line.split()))
-            positions.append(data[1:4])
-            velocity.append(data[4:7])
-            color.append(generate_star_color(data[0]))
-            mass.append(data[0])
-
-    return np.array(positions), np.array(velocity), np.array(mass), np.array(color)
+    global integrator
+    return integrator.step(dt)
 
 
 if __name__ == "__main__":
-    global positions, velocity, mass, color, square_size, radius
+    global positions, velocity, mass, color, square_size, radius, integrator
 
     positions, velocity, mass, color = load_galaxy(f"data/galaxy_{sys.argv[2] if len(sys.argv) > 2 else '100'}")
 
     square_size, radius = initialize_grid(positions)
+    integrator = VelocityVerlet(positions, velocity, lambda pos: calculate_acceleration(pos, mass))
+    positions = integrator.positions
     dt = float(sys.argv[1]) if len(sys.argv) > 1 else 1e-2
 
     start = time.time()
@@ -150,5 +127,6 @@ if __name__ == "__main__":
     luminosities = np.ones(len(positions), dtype=np.float32)
     bounds = ((-3, 3), (-3, 3), (-3, 3))
 
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
     visualizer = Visualizer3D(positions, color, luminosities, bounds)
     visualizer.run(updater=step, dt=dt)
\ No newline at end of file
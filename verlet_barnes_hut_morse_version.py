@@ -1,12 +1,14 @@
 import numpy as np
 import time
-from galaxy_generator import generate_star_color
-from visualizer3d_vbo import Visualizer3D
+from galaxy.loader import load_galaxy
+from integrators import VelocityVerlet
 import sys
 import numba
 
 G = 1.560339e-13  # Gravitational constant
 
+# The grid kernels take C-contiguous float64 arrays and are cached on disk (see galaxy/warmup.py)
+
 def initialize_grid(positions):
     """
     Initialize square_size, radius and min coordinates from the current positions.
@@ -24,7 +26,7 @@ def initialize_grid(positions):
     return square_size, radius, min_x, min_y
 
 
-@numba.njit
+@numba.njit("(f8[:, ::1], f8[::1], f8, f8)", cache=True, nogil=True)
 def grid_matrice_crs(positions, square_size, min_x, min_y):
     """
     Organize stars into a grid using Compressed Sparse Row (CSR) logic.
@@ -60,62 +62,98 @@ def grid_matrice_crs(positions, square_size, min_x, min_y):
     return beg_cases, tab
 
 
-@numba.njit
-def cell_center_of_mass(positions, mass, beg_cases, tab, cell):
+@numba.njit("(f8[:, ::1], f8[::1], i8[::1], i8[::1])", parallel=True, cache=True, nogil=True)
+def cell_moments(positions, mass, beg_cases, tab):
     """
-    Compute the center of mass and total mass of all stars in a given cell.
+    Compute once the center of mass, total mass and traceless quadrupole of every cell of the grid.
     Formula: Center_of_mass = (sum_j m_j * x_j) / (sum m_j)
+             Q_ab = sum_j m_j * (3 d_a d_b - |d|^2 delta_ab), with d = x_j - Center_of_mass
+    Returns an array of shape (400, 10) where each row is (cx, cy, cz, total_mass, Qxx, Qyy, Qzz, Qxy, Qxz, Qyz).
     """
-    cx, cy, cz = 0.0, 0.0, 0.0
-    total_mass = 0.0
-    for k in range(beg_cases[cell], beg_cases[cell + 1]):
-        j = tab[k]
-        m = mass[j]
-        cx += positions[j][0] * m
-        cy += positions[j][1] * m
-        cz += positions[j][2] * m
-        total_mass += m
-    if total_mass > 0.0:
-        cx /= total_mass
-        cy /= total_mass
-        cz /= total_mass
-    return cx, cy, cz, total_mass
-
-@numba.njit(parallel=True)
-def calculate_acceleration(positions, mass, square_size, radius, min_x, min_y):
+    moments = np.zeros((400, 10), dtype=np.float64)
+
+    for cell in numba.prange(400):
+        cx, cy, cz = 0.0, 0.0, 0.0
+        total_mass = 0.0
+        for k in range(beg_cases[cell], beg_cases[cell + 1]):
+            j = tab[k]
+            m = mass[j]
+            cx += positions[j][0] * m
+            cy += positions[j][1] * m
+            cz += positions[j][2] * m
+            total_mass += m
+        if total_mass > 0.0:
+            cx /= total_mass
+            cy /= total_mass
+            cz /= total_mass
+        moments[cell, 0] = cx
+        moments[cell, 1] = cy
+        moments[cell, 2] = cz
+        moments[cell, 3] = total_mass
+
+        qxx, qyy, qzz, qxy, qxz, qyz = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
+        for k in range(beg_cases[cell], beg_cases[cell + 1]):
+            j = tab[k]
+            m = mass[j]
+            dx = positions[j][0] - cx
+            dy = positions[j][1] - cy
+            dz = positions[j][2] - cz
+            r2 = dx*dx + dy*dy + dz*dz
+            qxx += m * (3.0 * dx*dx - r2)
+            qyy += m * (3.0 * dy*dy - r2)
+            qzz += m * (3.0 * dz*dz - r2)
+            qxy += m * 3.0 * dx*dy
+            qxz += m * 3.0 * dx*dz
+            qyz += m * 3.0 * dy*dz
+        moments[cell, 4] = qxx
+        moments[cell, 5] = qyy
+        moments[cell, 6] = qzz
+        moments[cell, 7] = qxy
+        moments[cell, 8] = qxz
+        moments[cell, 9] = qyz
+
+    return moments
+
+
+@numba.njit("(f8[:, ::1], f8[::1], i8[::1], i8[::1], f8[:, ::1], f8)", parallel=True, cache=True, nogil=True)
+def grid_acceleration(positions, mass, beg_cases, tab, moments, radius):
     """
     Compute gravitational acceleration using a Barnes-Hut-like approximation.
-    If a cell is distant (0.5 * dist > radius), use its center of mass.
+    If a cell is distant (0.5 * dist > radius), use its monopole and quadrupole from the moments array:
+    with d the vector from the star to the center of mass, G * (M d / r^3 - Q d / r^5 + 5/2 (d.Q.d) d / r^7).
     Otherwise, compute particle-to-particle interactions within the cell.
     """
-    beg_cases, tab = grid_matrice_crs(positions, square_size, min_x, min_y)
-
     n = positions.shape[0]
     accelerations = np.zeros((n, 3), dtype=np.float64)
 
     for i in numba.prange(n):
-        acc = np.zeros(3)
+        ax, ay, az = 0.0, 0.0, 0.0
 
         for cell in range(400): # 20 * 20
-    
-            if beg_cases[cell] == beg_cases[cell + 1]: # Skip empty cells
-                continue
 
-            cx, cy, cz, total_mass = cell_center_of_mass(positions, mass, beg_cases, tab, cell)
+            total_mass = moments[cell, 3]
+            if total_mass == 0.0: # Skip empty cells
+                continue
 
             # Distance from star i to the cell's center of mass
-            dx = cx - positions[i][0]
-            dy = cy - positions[i][1]
-            dz = cz - positions[i][2]
+            dx = moments[cell, 0] - positions[i][0]
+            dy = moments[cell, 1] - positions[i][1]
+            dz = moments[cell, 2] - positions[i][2]
             dist = np.sqrt(dx*dx + dy*dy + dz*dz)
             if dist < 1e-10:
                 continue
 
-            if 0.5 * dist > radius: # Far cell : treat as a single body at its center of mass
-                dist3 = dist**3
-                acc[0] += G * total_mass * dx / dist3
-                acc[1] += G * total_mass * dy / dist3
-                acc[2] += G * total_mass * dz / dist3
+            if 0.5 * dist > radius: # Far cell : monopole and quadrupole around its center of mass
+                inv2 = 1.0 / (dist * dist)
+                inv3 = inv2 / dist
+                inv5 = inv3 * inv2
+                qdx = moments[cell, 4] * dx + moments[cell, 7] * dy + moments[cell, 8] * dz
+                qdy = moments[cell, 7] * dx + moments[cell, 5] * dy + moments[cell, 9] * dz
+                qdz = moments[cell, 8] * dx + moments[cell, 9] * dy + moments[cell, 6] * dz
+                f = total_mass * inv3 + 2.5 * (dx*qdx + dy*qdy + dz*qdz) * inv5 * inv2
+                ax += G * (f * dx - qdx * inv5)
+                ay += G * (f * dy - qdy * inv5)
+                az += G * (f * dz - qdz * inv5)
 
             else: # Near cell : sum over individual stars
                 for k in range(beg_cases[cell], beg_cases[cell + 1]):
@@ -128,54 +166,58 @@ def calculate_acceleration(positions, mass, square_size, radius, min_x, min_y):
                     dist = np.sqrt(dx*dx + dy*dy + dz*dz)
                     if dist > 1e-10:
                         dist3 = dist**3
-                        acc[0] += G * mass[j] * dx / dist3
-                        acc[1] += G * mass[j] * dy / dist3
-                        acc[2] += G * mass[j] * dz / dist3
+                        ax += G * mass[j] * dx / dist3
+                        ay += G * mass[j] * dy / dist3
+                        az += G * mass[j] * dz / dist3
 
-        accelerations[i] = acc
+        accelerations[i, 0] = ax
+        accelerations[i, 1] = ay
+        accelerations[i, 2] = az
 
     return accelerations
 
 
-def step(dt):
+@numba.njit("(f8[:, ::1], f8[::1], f8[::1], f8, f8, f8)", cache=True, nogil=True)
+def calculate_acceleration(positions, mass, square_size, radius, min_x, min_y):
     """
-    Updates the all the positions in the system after a time step dt using the Verlet integration method.
+    Compute gravitational acceleration on the CSR grid in three stages:
+    star assignment (grid_matrice_crs), cell moments (cell_moments), then the force kernel.
     """
-    global positions, velocity, mass
+    beg_cases, tab = grid_matrice_crs(positions, square_size, min_x, min_y)
+    moments = cell_moments(positions, mass, beg_cases, tab)
+    return grid_acceleration(positions, mass, beg_cases, tab, moments, radius)
 
-    square_size, radius, min_x, min_y = initialize_grid(positions) # Update grid based on current positions
-    acc = calculate_acceleration(positions, mass, square_size, radius, min_x, min_y)
 
-    new_pos = positions + velocity * dt + 0.5 * acc * dt**2
-    new_acc = calculate_acceleration(new_pos, mass, square_size, radius, min_x, min_y)
-    new_vel = velocity + 0.5 * (acc + new_acc) * dt
+def grid_acceleration_func(mass):
+    """
+    Return a function computing the accelerations from the positions only,
+    with the grid rebuilt on the current positions at each call.
+    """
+    mass = np.array(mass, dtype=np.float64) # writable float64 copy, as expected by the compiled kernels
+    def accel(positions):
+        positions = np.require(positions, np.float64, ["C", "W"]) # the kernels only take C-contiguous float64 arrays
+        square_size, radius, min_x, min_y = initialize_grid(positions)
+        return calculate_acceleration(positions, mass, square_size, radius, min_x, min_y)
+    return accel
 
-    positions = new_pos
-    velocity  = new_vel
-    return positions
 
-def load_galaxy(filename):
+def step(dt):
     """
-    Load a system of bodies from a file like (mass, positionx, positiony, positionz, velocityx, velocityy, velocityz)
+    Updates the all the positions in the system after a time step dt using the Verlet integration method.
+    The integrator keeps the end-of-step acceleration, so each step needs one force evaluation.
     """
-    positions, velocity, color, mass = [], [], [], []
-    with open(filename, 'r') as file:
-        for line in file:
-            data = list(map(float, line.split()))
-            mass.append(data[0])
-            positions.append(data[1:4])
-            velocity.append(data[4:7])
-            color.append(generate_star_color(data[0]))
-    return (np.array(positions), np.array(velocity), np.array(mass), np.array(color))
+    global integrator
+    return integrator.step(dt)
 
 
 if __name__ == "__main__":
-    global positions, velocity, mass, color, square_size, radius
+    global positions, velocity, mass, color, integrator
 
     galaxy_file = "data/galaxy_{}".format(sys.argv[2] if len(sys.argv) > 2 else "100")
     positions, velocity, mass, color = load_galaxy(galaxy_file)
 
-    square_size, radius, min_x, min_y = initialize_grid(positions)
+    integrator = VelocityVerlet(positions, velocity, grid_acceleration_func(mass))
+    positions = integrator.positions
 
     dt = float(sys.argv[1]) if len(sys.argv) > 1 else 1e-3
 
@@ -190,5 +232,6 @@ if __name__ == "__main__":
     luminosities = np.ones(len(positions), dtype=np.float32)
     bounds = ((-3, 3), (-3, 3), (-3, 3))
 
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
     visualizer = Visualizer3D(positions, color, luminosities, bounds)
     visualizer.run(updater=step, dt=dt)
\ No newline at end of file
@@ -0,0 +1,469 @@
+import numpy as np
+import time
+from galaxy.loader import load_galaxy
+from integrators import VelocityVerlet
+import sys
+import numba
+
+G = 1.560339e-13  # Gravitational constant
+
+MAX_DEPTH = 21 # 21 bits per axis -> 63-bit Morton keys
+
+# The tree kernels take C-contiguous float64 arrays and are cached on disk (see galaxy/warmup.py)
+
+
+@numba.njit("(i8,)", cache=True, nogil=True)
+def spread_bits(v):
+    """
+    Spread the 21 lower bits of v so that there are two zero bits between each of them.
+    """
+    v &= 0x1fffff
+    v = (v | (v << 32)) & 0x1f00000000ffff
+    v = (v | (v << 16)) & 0x1f0000ff0000ff
+    v = (v | (v << 8)) & 0x100f00f00f00f00f
+    v = (v | (v << 4)) & 0x10c30c30c30c30c3
+    v = (v | (v << 2)) & 0x1249249249249249
+    return v
+
+
+@numba.njit("(f8[:, ::1], f8[::1], f8)", parallel=True, cache=True, nogil=True)
+def morton_keys(positions, origin, size):
+    """
+    Compute the Morton (Z-order) key of each star inside the root cube [origin, origin + size].
+    The octant of a star at a given level is encoded by 3 bits of its key : x is the high bit, z the low bit.
+    """
+    n = positions.shape[0]
+    keys = np.empty(n, dtype=np.int64)
+    scale = (1 << MAX_DEPTH) / size
+    top = (1 << MAX_DEPTH) - 1
+    for i in numba.prange(n):
+        ix = min(int((positions[i, 0] - origin[0]) * scale), top)
+        iy = min(int((positions[i, 1] - origin[1]) * scale), top)
+        iz = min(int((positions[i, 2] - origin[2]) * scale), top)
+        keys[i] = (spread_bits(ix) << 2) | (spread_bits(iy) << 1) | spread_bits(iz)
+    return keys
+
+
+@numba.njit(["(i8[::1], i8)", "(f8[::1], i8)", "(f8[:, ::1], i8)", "(b1[::1], i8)"], cache=True, nogil=True)
+def grow(array, capacity):
+    """
+    Return a copy of array with its first dimension enlarged to capacity.
+    """
+    new = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    new[:array.shape[0]] = array
+    return new
+
+
+@numba.njit("(f8[:, ::1], i8)", cache=True, nogil=True)
+def build_octree(positions, leaf_size):
+    """
+    Build an octree over the Morton-sorted stars.
+    Nodes are stored in depth-first (pre-order) in flat arrays :
+    - order : star IDs sorted by Morton key, a node owns the stars order[node_start[k]:node_end[k]]
+    - node_size : edge length of the node cube
+    - node_center : geometric center of the node cube
+    - node_next : index of the first node after the subtree of node k (used to skip a subtree)
+    - node_leaf : True if the node is not subdivided
+    The first child of an internal node k is always node k + 1.
+    """
+    n = positions.shape[0]
+
+    # Root cube: smallest cube containing every star, plus a small margin
+    low = np.empty(3)
+    high = np.empty(3)
+    for d in range(3):
+        low[d] = positions[:, d].min()
+        high[d] = positions[:, d].max()
+    size = max(high[0] - low[0], high[1] - low[1], high[2] - low[2]) * 1.0001 + 1e-12
+    origin = 0.5 * (low + high) - 0.5 * size
+
+    keys = morton_keys(positions, origin, size)
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    capacity = max(16, 2 * n)
+    node_start = np.empty(capacity, dtype=np.int64)
+    node_end = np.empty(capacity, dtype=np.int64)
+    node_depth = np.empty(capacity, dtype=np.int64)
+    node_size = np.empty(capacity, dtype=np.float64)
+    node_center = np.empty((capacity, 3), dtype=np.float64)
+    node_leaf = np.empty(capacity, dtype=np.bool_)
+
+    # Explicit stack (start, end, depth, cx, cy, cz) : children are pushed in reverse order so that
+    # they are popped in octant order, which gives a pre-order numbering of the nodes.
+    stack_int = np.empty((8 * MAX_DEPTH + 8, 3), dtype=np.int64)
+    stack_center = np.empty((8 * MAX_DEPTH + 8, 3), dtype=np.float64)
+    stack_int[0, 0] = 0
+    stack_int[0, 1] = n
+    stack_int[0, 2] = 0
+    stack_center[0] = origin + 0.5 * size
+    top = 1
+
+    n_nodes = 0
+    child_start = np.empty(9, dtype=np.int64)
+    while top > 0:
+        top -= 1
+        start, end, depth = stack_int[top, 0], stack_int[top, 1], stack_int[top, 2]
+
+        if n_nodes == capacity:
+            capacity *= 2
+            node_start = grow(node_start, capacity)
+            node_end = grow(node_end, capacity)
+            node_depth = grow(node_depth, capacity)
+            node_size = grow(node_size, capacity)
+            node_center = grow(node_center, capacity)
+            node_leaf = grow(node_leaf, capacity)
+
+        k = n_nodes
+        n_nodes += 1
+        edge = size / (1 << depth)
+        node_start[k] = start
+        node_end[k] = end
+        node_depth[k] = depth
+        node_size[k] = edge
+        node_center[k] = stack_center[top]
+        node_leaf[k] = end - start <= leaf_size or depth == MAX_DEPTH
+        if node_leaf[k]:
+            continue
+
+        # Split the (sorted) range into the 8 octants of the next level
+        shift = 3 * (MAX_DEPTH - 1 - depth)
+        j = start
+        for octant in range(8):
+            child_start[octant] = j
+            while j < end and (keys[j] >> shift) & 7 == octant:
+                j += 1
+        child_start[8] = end
+
+        quarter = 0.25 * edge
+        for octant in range(7, -1, -1):
+            if child_start[octant] == child_start[octant + 1]: # Skip empty octants
+                continue
+            stack_int[top, 0] = child_start[octant]
+            stack_int[top, 1] = child_start[octant + 1]
+            stack_int[top, 2] = depth + 1
+            stack_center[top, 0] = node_center[k, 0] + (quarter if octant & 4 else -quarter)
+            stack_center[top, 1] = node_center[k, 1] + (quarter if octant & 2 else -quarter)
+            stack_center[top, 2] = node_center[k, 2] + (quarter if octant & 1 else -quarter)
+            top += 1
+
+    # node_next[k] is the first following node which is not a descendant of k
+    node_next = np.empty(n_nodes, dtype=np.int64)
+    open_nodes = np.empty(MAX_DEPTH + 1, dtype=np.int64)
+    n_open = 0
+    for k in range(n_nodes):
+        while n_open > 0 and node_depth[open_nodes[n_open - 1]] >= node_depth[k]:
+            n_open -= 1
+            node_next[open_nodes[n_open]] = k
+        open_nodes[n_open] = k
+        n_open += 1
+    while n_open > 0:
+        n_open -= 1
+        node_next[open_nodes[n_open]] = n_nodes
+
+    return (order, node_start[:n_nodes], node_end[:n_nodes], node_size[:n_nodes],
+            node_center[:n_nodes], node_next, node_leaf[:n_nodes])
+
+
+@numba.njit("(f8[:, ::1], f8[::1], i8[::1], i8[::1], i8[::1], f8[::1], f8[:, ::1], f8)", parallel=True, cache=True, nogil=True)
+def node_moments(positions, mass, order, node_start, node_end, node_size, node_center, theta):
+    """
+    Compute the mass, center of mass and traceless quadrupole of every node, and the squared critical
+    distance beyond which the node can be replaced by its multipole expansion around its center of mass.
+    The quadrupole Q_ab = sum_j m_j (3 d_a d_b - |d|^2 delta_ab), with d = x_j - center of mass,
+    is stored as (Qxx, Qyy, Qzz, Qxy, Qxz, Qyz).
+    The critical distance is size / theta + offset, where offset is the distance between the
+    geometric center and the center of mass of the node, so that a star is never approximated
+    by a node it belongs to.
+    """
+    n_nodes = node_start.shape[0]
+    node_mass = np.zeros(n_nodes, dtype=np.float64)
+    node_com = np.zeros((n_nodes, 3), dtype=np.float64)
+    node_rcrit2 = np.zeros(n_nodes, dtype=np.float64)
+    node_quad = np.zeros((n_nodes, 6), dtype=np.float64)
+
+    for k in numba.prange(n_nodes):
+        cx, cy, cz = 0.0, 0.0, 0.0
+        total_mass = 0.0
+        for s in range(node_start[k], node_end[k]):
+            j = order[s]
+            m = mass[j]
+            cx += positions[j, 0] * m
+            cy += positions[j, 1] * m
+            cz += positions[j, 2] * m
+            total_mass += m
+        if total_mass > 0.0:
+            cx /= total_mass
+            cy /= total_mass
+            cz /= total_mass
+        node_mass[k] = total_mass
+        node_com[k, 0] = cx
+        node_com[k, 1] = cy
+        node_com[k, 2] = cz
+
+        qxx, qyy, qzz, qxy, qxz, qyz = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
+        for s in range(node_start[k], node_end[k]):
+            j = order[s]
+            m = mass[j]
+            dx = positions[j, 0] - cx
+            dy = positions[j, 1] - cy
+            dz = positions[j, 2] - cz
+            r2 = dx*dx + dy*dy + dz*dz
+            qxx += m * (3.0 * dx*dx - r2)
+            qyy += m * (3.0 * dy*dy - r2)
+            qzz += m * (3.0 * dz*dz - r2)
+            qxy += m * 3.0 * dx*dy
+            qxz += m * 3.0 * dx*dz
+            qyz += m * 3.0 * dy*dz
+        node_quad[k, 0] = qxx
+        node_quad[k, 1] = qyy
+        node_quad[k, 2] = qzz
+        node_quad[k, 3] = qxy
+        node_quad[k, 4] = qxz
+        node_quad[k, 5] = qyz
+
+        ox = cx - node_center[k, 0]
+        oy = cy - node_center[k, 1]
+        oz = cz - node_center[k, 2]
+        rcrit = node_size[k] / theta + np.sqrt(ox*ox + oy*oy + oz*oz)
+        node_rcrit2[k] = rcrit * rcrit
+
+    return node_mass, node_com, node_quad, node_rcrit2
+
+
+@numba.njit("(f8[::1], f8, f8, f8, f8)", cache=True, nogil=True)
+def add_quadrupole(q, m, dx, dy, dz):
+    """
+    Add the traceless quadrupole of a mass m at offset (dx, dy, dz) to q = (Qxx, Qyy, Qzz, Qxy, Qxz, Qyz).
+    """
+    r2 = dx*dx + dy*dy + dz*dz
+    q[0] += m * (3.0 * dx*dx - r2)
+    q[1] += m * (3.0 * dy*dy - r2)
+    q[2] += m * (3.0 * dz*dz - r2)
+    q[3] += m * 3.0 * dx*dy
+    q[4] += m * 3.0 * dx*dz
+    q[5] += m * 3.0 * dy*dz
+
+
+@numba.njit("(f8[:, ::1], f8[::1], i8[::1], i8[::1], i8[::1], f8[::1], f8[:, ::1], i8[::1], b1[::1], f8)", cache=True, nogil=True)
+def refresh_moments(positions, mass, order, node_start, node_end, node_size, node_center, node_next, node_leaf, theta):
+    """
+    Same moments as node_moments for a tree built at earlier positions (the stars have moved but keep their
+    nodes), computed bottom-up: leaves sum their stars, internal nodes combine their children (parallel axis
+    theorem for the quadrupole), so the cost is O(N + nodes) instead of O(N * depth).
+    The stars of a node may have left its cube: the critical distance uses the cube around the same center
+    that contains them (its half edge node_half), which keeps a star from being approximated by its own node.
+    """
+    n_nodes = node_start.shape[0]
+    node_mass = np.zeros(n_nodes, dtype=np.float64)
+    node_com = np.zeros((n_nodes, 3), dtype=np.float64)
+    node_rcrit2 = np.zeros(n_nodes, dtype=np.float64)
+    node_quad = np.zeros((n_nodes, 6), dtype=np.float64)
+    node_half = np.empty(n_nodes, dtype=np.float64)
+    com = np.empty(3)
+    q = np.empty(6)
+
+    for k in range(n_nodes - 1, -1, -1): # pre-order: the children of k come after k
+        half = 0.5 * node_size[k]
+        total_mass = 0.0
+        com[:] = 0.0
+        if node_leaf[k]:
+            for s in range(node_start[k], node_end[k]):
+                j = order[s]
+                total_mass += mass[j]
+                for d in range(3):
+                    com[d] += positions[j, d] * mass[j]
+                    half = max(half, abs(positions[j, d] - node_center[k, d]))
+        else:
+            c = k + 1
+            while c < node_next[k]:
+                total_mass += node_mass[c]
+                for d in range(3):
+                    com[d] += node_com[c, d] * node_mass[c]
+                    half = max(half, abs(node_center[c, d] - node_center[k, d]) + node_half[c])
+                c = node_next[c]
+        if total_mass > 0.0:
+            com /= total_mass
+        node_mass[k] = total_mass
+        node_com[k] = com
+        node_half[k] = half
+
+        # Quadrupole around com: stars of a leaf, or children quadrupoles moved from their own centers of mass
+        q[:] = 0.0
+        if node_leaf[k]:
+            for s in range(node_start[k], node_end[k]):
+                j = order[s]
+                add_quadrupole(q, mass[j], positions[j, 0] - com[0], positions[j, 1] - com[1], positions[j, 2] - com[2])
+        else:
+            c = k + 1
+            while c < node_next[k]:
+                q += node_quad[c]
+                add_quadrupole(q, node_mass[c], node_com[c, 0] - com[0], node_com[c, 1] - com[1], node_com[c, 2] - com[2])
+                c = node_next[c]
+        node_quad[k] = q
+
+        ox = com[0] - node_center[k, 0]
+        oy = com[1] - node_center[k, 1]
+        oz = com[2] - node_center[k, 2]
+        rcrit = 2.0 * half / theta + np.sqrt(ox*ox + oy*oy + oz*oz)
+        node_rcrit2[k] = rcrit * rcrit
+
+    return node_mass, node_com, node_quad, node_rcrit2
+
+
+@numba.njit("(f8[:, ::1], f8[::1], i8[::1], i8[::1], i8[::1], i8[::1], b1[::1], f8[::1], f8[:, ::1], f8[:, ::1], f8[::1], i8[::1])",
+            parallel=True, cache=True, nogil=True)
+def tree_walk(positions, mass, order, node_start, node_end, node_next, node_leaf, node_mass, node_com, node_quad,
+              node_rcrit2, targets):
+    """
+    Compute the acceleration of the stars of indices targets (an array of shape (len(targets), 3)) by walking
+    the octree without a stack : an accepted node or a leaf jumps to node_next, an opened node goes down to
+    its first child (k + 1).
+    With d the vector from the star to the center of mass of an accepted node, the node contributes
+    G * (M d / r^3 - Q d / r^5 + 5/2 (d.Q.d) d / r^7) (monopole and quadrupole terms).
+    """
+    n_nodes = node_start.shape[0]
+    accelerations = np.zeros((targets.shape[0], 3), dtype=np.float64)
+
+    for t in numba.prange(targets.shape[0]):
+        i = targets[t]
+        px, py, pz = positions[i, 0], positions[i, 1], positions[i, 2]
+        ax, ay, az = 0.0, 0.0, 0.0
+        k = 0
+        while k < n_nodes:
+            dx = node_com[k, 0] - px
+            dy = node_com[k, 1] - py
+            dz = node_com[k, 2] - pz
+            dist2 = dx*dx + dy*dy + dz*dz
+
+            if dist2 > node_rcrit2[k]: # Far node : monopole and quadrupole around its center of mass
+                inv2 = 1.0 / dist2
+                inv3 = np.sqrt(inv2) * inv2
+                inv5 = inv3 * inv2
+                qxx, qyy, qzz = node_quad[k, 0], node_quad[k, 1], node_quad[k, 2]
+                qxy, qxz, qyz = node_quad[k, 3], node_quad[k, 4], node_quad[k, 5]
+                qdx = qxx*dx + qxy*dy + qxz*dz
+                qdy = qxy*dx + qyy*dy + qyz*dz
+                qdz = qxz*dx + qyz*dy + qzz*dz
+                f = node_mass[k] * inv3 + 2.5 * (dx*qdx + dy*qdy + dz*qdz) * inv5 * inv2
+                ax += G * (f * dx - qdx * inv5)
+                ay += G * (f * dy - qdy * inv5)
+                az += G * (f * dz - qdz * inv5)
+                k = node_next[k]
+
+            elif node_leaf[k]: # Near leaf : sum over individual stars
+                for s in range(node_start[k], node_end[k]):
+                    j = order[s]
+                    if i == j:
+                        continue
+                    dx = positions[j, 0] - px
+                    dy = positions[j, 1] - py
+                    dz = positions[j, 2] - pz
+                    dist = np.sqrt(dx*dx + dy*dy + dz*dz)
+                    if dist > 1e-10:
+                        f = G * mass[j] / (dist**3)
+                        ax += f * dx
+                        ay += f * dy
+                        az += f * dz
+                k = node_next[k]
+
+            else: # Near internal node : open it
+                k += 1
+
+        accelerations[t, 0] = ax
+        accelerations[t, 1] = ay
+        accelerations[t, 2] = az
+
+    return accelerations
+
+
+def calculate_acceleration(positions, mass, theta=0.8, leaf_size=8, targets=None):
+    """
+    Compute gravitational acceleration with a Barnes-Hut octree.
+    theta is the opening angle : a node of size s is replaced by its monopole and quadrupole when s / dist < theta.
+    theta = 0 gives back the exact direct summation, larger values are faster but less accurate.
+    With the quadrupole term, theta = 0.8 is both faster and more accurate than theta = 0.5 with the monopole alone.
+    If targets (indices) is given, only the accelerations of these stars are computed, in that order.
+    """
+    positions = np.require(positions, np.float64, ["C", "W"]) # the kernels only take C-contiguous float64 arrays
+    mass = np.require(mass, np.float64, ["C", "W"])
+    if targets is None:
+        targets = np.arange(positions.shape[0])
+    targets = np.require(targets, np.int64, ["C", "W"])
+    order, node_start, node_end, node_size, node_center, node_next, node_leaf = build_octree(positions, leaf_size)
+    node_mass, node_com, node_quad, node_rcrit2 = node_moments(positions, mass, order, node_start, node_end,
+                                                               node_size, node_center, theta)
+    return tree_walk(positions, mass, order, node_start, node_end, node_next, node_leaf,
+                     node_mass, node_com, node_quad, node_rcrit2, targets)
+
+
+class SubsetAcceleration:
+    """
+    calculate_acceleration restricted to the stars of indices targets, for the block time steps, reusing the
+    octree between calls: when only a few stars are active, the Morton sort, the tree construction and
+    node_moments would cost much more than their walks, so the node moments are only refreshed bottom-up
+    (refresh_moments) at the current positions.
+    The tree is rebuilt when at least rebuild_fraction of the stars are active (at the end of every block
+    step all of them are), its walks then costing much more than its construction.
+
+    Usage:
+        subset = SubsetAcceleration(mass, theta=0.8)
+        acc = subset(positions, targets)
+    """
+
+    def __init__(self, mass, theta=0.8, leaf_size=8, rebuild_fraction=0.25):
+        self.mass = np.require(mass, np.float64, ["C", "W"])
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.rebuild_fraction = rebuild_fraction
+        self.tree = None
+
+    def __call__(self, positions, targets):
+        positions = np.require(positions, np.float64, ["C", "W"])
+        targets = np.require(targets, np.int64, ["C", "W"])
+        if self.tree is None or targets.shape[0] >= self.rebuild_fraction * positions.shape[0]:
+            self.tree = build_octree(positions, self.leaf_size)
+            order, node_start, node_end, node_size, node_center, node_next, node_leaf = self.tree
+            moments = node_moments(positions, self.mass, order, node_start, node_end, node_size, node_center, self.theta)
+        else:
+            order, node_start, node_end, node_size, node_center, node_next, node_leaf = self.tree
+            moments = refresh_moments(positions, self.mass, order, node_start, node_end, node_size, node_center,
+                                      node_next, node_leaf, self.theta)
+        return tree_walk(positions, self.mass, order, node_start, node_end, node_next, node_leaf, *moments, targets)
+
+
+def step(dt):
+    """
+    Updates the all the positions in the system after a time step dt using the Verlet integration method.
+    The integrator keeps the end-of-step acceleration, so each step needs one force evaluation.
+    """
+    global integrator
+    return integrator.step(dt)
+
+
+if __name__ == "__main__":
+    global positions, velocity, mass, color, integrator
+
+    galaxy_file = "data/galaxy_{}".format(sys.argv[2] if len(sys.argv) > 2 else "100")
+    positions, velocity, mass, color = load_galaxy(galaxy_file)
+
+    dt = float(sys.argv[1]) if len(sys.argv) > 1 else 1e-3
+    theta = float(sys.argv[3]) if len(sys.argv) > 3 else 0.8
+
+    integrator = VelocityVerlet(positions, velocity, lambda pos: calculate_acceleration(pos, mass, theta))
+    positions = integrator.positions
+
+    # Time the execution of 10 steps
+    start_time = time.time()
+    for _ in range(10):
+        step(dt)
+    end_time = time.time()
+    print(f"Time for 10 steps ({len(mass)} bodies, theta={theta}): {end_time - start_time:.4f} seconds\n")
+
+    # Visualization
+    luminosities = np.ones(len(positions), dtype=np.float32)
+    bounds = ((-3, 3), (-3, 3), (-3, 3))
+
+    from visualizer3d_vbo import Visualizer3D # SDL2/OpenGL are only loaded when a window is opened
+    visualizer = Visualizer3D(positions, color, luminosities, bounds)
+    visualizer.run(updater=step, dt=dt)
@@ -17,6 +17,10 @@ Utilisation :
     
     # Pour mettre à jour les points :
     visualizer.update_points(new_points, new_colors, new_luminosities)
+
+    # Ou écrire directement les positions float32 dans le buffer de staging, sans copie :
+    np.copyto(visualizer.points, new_points, casting="same_kind")
+    visualizer.update_points(visualizer.points)
 """
 
 import numpy as np
@@ -48,10 +52,11 @@ class Visualizer3D:
             luminosities (np.ndarray): Luminosités des points, shape (N,), valeurs entre 0 et 1
             bounds (tuple): Limites de l'espace ((xmin, xmax), (ymin, ymax), (zmin, zmax))
         """
-        # Stockage des données des points
+        # Stockage des données des points (self.points sert aussi de buffer de staging float32)
         self.points = np.array(points, dtype=np.float32)
         self.colors = np.array(colors, dtype=np.float32)
         self.luminosities = np.array(luminosities, dtype=np.float32)
+        self.colors_with_luminosity = np.empty((len(self.points), 3), dtype=np.float32)
         self.bounds = bounds
         
         # Paramètres de la fenêtre
@@ -78,7 +83,11 @@ class Visualizer3D:
         # Vertex Buffer Objects pour optimisation GPU
         self.vbo_vertices = None
         self.vbo_colors = None
-        self.vbo_needs_update = True
+        self.vbo_size = 0  # Nombre de points pour lequel la mémoire des VBO est allouée
+        
+        # Indicateurs de mise à jour : seules les données modifiées sont recalculées et envoyées au GPU
+        self.points_dirty = True
+        self.colors_dirty = True  # Couleurs ou luminosités modifiées
         
         # Calcul du centre de la scène (pour centrer la visualisation)
         self.center = np.array([
@@ -174,28 +183,53 @@ class Visualizer3D:
         self.vbo_vertices = glGenBuffers(1)
         self.vbo_colors = glGenBuffers(1)
         
-        # Initialisation des buffers avec les données
+        # Allocation de la mémoire GPU et envoi des données initiales
+        self._allocate_vbo()
         self._update_vbo()
     
-    def _update_vbo(self):
+    def _allocate_vbo(self):
         """
-        Met à jour les données dans les VBO (vertices et couleurs).
+        Alloue la mémoire des VBO pour le nombre de points courant.
+        Appelé une seule fois, puis seulement si le nombre de points change :
+        les mises à jour réécrivent ensuite cette mémoire sans la réallouer.
         """
-        # Calcul des couleurs avec luminosité (vectorisé)
-        colors_with_luminosity = (self.colors * self.luminosities[:, np.newaxis] / 255.0).astype(np.float32)
+        nbytes = len(self.points) * 3 * 4  # (N, 3) float32
         
-        # Upload des vertices dans le VBO
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo_vertices)
-        glBufferData(GL_ARRAY_BUFFER, self.points.nbytes, self.points, GL_DYNAMIC_DRAW)
+        glBufferData(GL_ARRAY_BUFFER, nbytes, None, GL_STREAM_DRAW)  # Réécrit à chaque pas
         
-        # Upload des couleurs dans le VBO
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo_colors)
-        glBufferData(GL_ARRAY_BUFFER, colors_with_luminosity.nbytes, colors_with_luminosity, GL_DYNAMIC_DRAW)
+        glBufferData(GL_ARRAY_BUFFER, nbytes, None, GL_DYNAMIC_DRAW)  # Réécrit rarement
         
-        # Unbind
         glBindBuffer(GL_ARRAY_BUFFER, 0)
         
-        self.vbo_needs_update = False
+        self.vbo_size = len(self.points)
+        self.points_dirty = True
+        self.colors_dirty = True
+    
+    def _update_vbo(self):
+        """
+        Met à jour les données modifiées dans les VBO (vertices et/ou couleurs),
+        avec glBufferSubData dans la mémoire déjà allouée.
+        """
+        if self.vbo_size != len(self.points):
+            self._allocate_vbo()
+        
+        # Upload des vertices dans le VBO
+        if self.points_dirty:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo_vertices)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, self.points.nbytes, self.points)
+            self.points_dirty = False
+        
+        # Calcul des couleurs avec luminosité (vectorisé, dans un tableau préalloué) et upload dans le VBO
+        if self.colors_dirty:
+            np.multiply(self.colors, self.luminosities[:, np.newaxis] / 255.0, out=self.colors_with_luminosity)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo_colors)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, self.colors_with_luminosity.nbytes, self.colors_with_luminosity)
+            self.colors_dirty = False
+        
+        # Unbind
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
     
     def _setup_camera(self):
         """
@@ -227,7 +261,7 @@ class Visualizer3D:
         self._setup_camera()
         
         # Mise à jour des VBO si nécessaire
-        if self.vbo_needs_update:
+        if self.points_dirty or self.colors_dirty:
             self._update_vbo()
         
         # Dessin des points avec VBO (rendu GPU optimisé)
@@ -327,24 +361,45 @@ class Visualizer3D:
             points (np.ndarray): Nouvelles coordonnées des points, shape (N, 3)
             colors (np.ndarray, optional): Nouvelles couleurs, shape (N, 3)
             luminosities (np.ndarray, optional): Nouvelles luminosités, shape (N,)
+        
+        Les données sont copiées (et converties en float32) dans les tableaux existants, sans allocation.
+        points peut être self.points lui-même, après que la simulation y a écrit directement ses positions.
         """
-        self.points = np.array(points, dtype=np.float32)
+        if points is not self.points:
+            if np.shape(points) == self.points.shape:
+                np.copyto(self.points, points, casting="same_kind")
+            else:  # Le nombre de points a changé : nouveaux tableaux (et VBO réalloués au prochain rendu)
+                self.points = np.array(points, dtype=np.float32)
+                self.colors_with_luminosity = np.empty((len(self.points), 3), dtype=np.float32)
+        self.points_dirty = True
         
         if colors is not None:
-            self.colors = np.array(colors, dtype=np.float32)
+            if np.shape(colors) == self.colors.shape:
+                np.copyto(self.colors, colors, casting="unsafe")
+            else:
+                self.colors = np.array(colors, dtype=np.float32)
+            self.colors_dirty = True
         
         if luminosities is not None:
-            self.luminosities = np.array(luminosities, dtype=np.float32)
-        
-        # Marquer les VBO pour mise à jour au prochain rendu
-        self.vbo_needs_update = True
+            if np.shape(luminosities) == self.luminosities.shape:
+                np.copyto(self.luminosities, luminosities, casting="unsafe")
+            else:
+                self.luminosities = np.array(luminosities, dtype=np.float32)
+            self.colors_dirty = True
     
-    def run(self, updater=None, dt = 0.001 ): #updater est une fonction qui prend en entrée dt et retourne les nouveaux points
+    def run(self, updater=None, dt = 0.001, frames=None): #updater est une fonction qui prend en entrée dt et retourne les nouveaux points
         """
         Lance la boucle principale de visualisation.
         
         Cette méthode bloque jusqu'à ce que l'utilisateur ferme la fenêtre
         ou appuie sur ESC.
+
+        Args:
+            updater (callable, optional): updater(dt) avance la simulation d'un pas et retourne les nouveaux points
+            dt (float): pas de temps passé à updater
+            frames (callable, optional): frames() retourne les dernières positions publiées par une simulation
+                qui tourne en parallèle (voir galaxy.pipeline), ou None s'il n'y en a pas de nouvelles ;
+                le rendu ne dépend alors plus du temps de calcul d'un pas
         """
         self.running = True
         
@@ -367,6 +422,12 @@ class Visualizer3D:
             # Mise à jour via la fonction updater si fournie
             if updater is not None:
                 self.update_points(updater(dt))
+
+            # Dernière frame publiée par la simulation en parallèle, sans l'attendre
+            if frames is not None:
+                points = frames()
+                if points is not None:
+                    self.update_points(points)
             
             # Petite pause pour ne pas surcharger le CPU
             #sdl2.SDL_Delay(10)